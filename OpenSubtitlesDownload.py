@@ -25,18 +25,31 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import io
 import os
 import re
 import sys
 import time
+import atexit
 import shutil
+import socket
+import pstats
+import base64
 import struct
+import cProfile
+import sqlite3
+import tracemalloc
 import argparse
+import tempfile
 import mimetypes
+import threading
 import subprocess
+import concurrent.futures
 
 import json
+import http.client
 import urllib
+import urllib.parse
 import urllib.request
 import urllib.error
 
@@ -96,9 +109,21 @@ opt_language_suffix_separator = '_'
 # - hash_and_filename (search using both methods)
 opt_search_mode = 'hash_then_filename'
 
+# Parse scene release names (ex: 'Show.S02E05.1080p.WEB.x264-GRP.mkv') to search by title, year, season
+# and episode, instead of using the raw filename. Gives smaller and more accurate filename search results.
+opt_search_release_parsing = True
+
 # Search and download a subtitles even if one already exists.
 opt_search_overwrite = True
 
+# When skipping videos with existing subtitles ('-i'), also look for subtitles tracks embedded
+# in MKV/MP4 files (in one of the requested languages).
+opt_search_embedded = True
+
+# Also search subtitles for the video files stored in RAR and ZIP archives (even multi-volume), as long as they
+# are not compressed (ex: scene releases). The subtitles are saved next to the archive, named after the video file.
+opt_search_archives = True
+
 # Subtitles selection mode. Can be overridden at run time with '-t' argument.
 # - default (in case of multiple results, lets you choose the subtitles you want)
 # - manual (always let you choose the subtitles you want)
@@ -121,6 +146,107 @@ opt_ignore_ai_translated = False
 # Ignore "foreign parts only" subtitles?
 opt_ignore_foreign_parts_only = False
 
+# ==== Hashing settings ========================================================
+
+# When several video files are processed at once, they are all hashed before being dispatched,
+# grouped by storage device (devices are read in parallel) and sorted by inode to limit seeks.
+# Number of concurrent reads per device: use 1 for hard drives, more for SSDs and network shares.
+# Can be overridden at run time with '--hash-threads' argument.
+opt_hash_threads_per_device = 1
+
+# ==== Network settings ========================================================
+
+# Timeouts (in seconds) used to connect to the OpenSubtitles.com server, and then to wait for its answers.
+# Can be overridden at run time with '--timeout' argument (sets both).
+opt_timeout_connect = 10
+opt_timeout_read = 30
+
+# Maximum time (in seconds) spent on a single video file, or 0 to disable.
+# Can be overridden at run time with '--deadline' argument.
+opt_file_deadline = 300
+
+# Number of retries for idempotent requests (login, search, download) failing with
+# a transient error (connection error, timeout, HTTP 429 or 5xx).
+# The delay between retries (in seconds) is doubled after each attempt.
+# Can be overridden at run time with '--retries' argument.
+opt_retries = 3
+opt_retry_delay = 1.0
+
+# Send a duplicate search request if the first one didn't answer after this delay (in seconds).
+# The first answer is used. Set to 0 to disable. Can be overridden at run time with '--hedge' argument.
+opt_hedge_delay = 0
+
+# Circuit breaker: after this number of consecutive failed requests (across all running instances),
+# the OpenSubtitles.com API is considered down and the whole batch is paused. Set to 0 to disable.
+opt_breaker_threshold = 5
+
+# While the API is down, a single request is sent every 'probe interval' (in seconds) to check if it is back.
+# The batch resumes automatically, or gives up after 'max wait' (in seconds).
+opt_breaker_probe_interval = 60
+opt_breaker_max_wait = 1800
+
+# ==== Plan and apply settings =================================================
+
+# A run can be split in two phases: '--plan FILE' searches subtitles for all the videos and automatically
+# selects the best ones, writing the result into a JSON plan file (searches don't use any download quota).
+# Then '--apply FILE' only downloads the planned subtitles (ex: right after your download quota reset).
+# Minimum delay (in seconds) between two downloads during the 'apply' phase.
+opt_apply_interval = 1.0
+
+# ==== Metrics settings ========================================================
+
+# Write metrics about the run into this file, using the Prometheus text format
+# (ex: '/var/lib/node_exporter/textfile_collector/opensubtitles.prom'). Empty to disable.
+# Can be overridden at run time with '--metrics' argument.
+opt_metrics_path = ''
+
+# During long runs, refresh the metrics file every N seconds.
+opt_metrics_interval = 60
+
+# ==== Local index settings ====================================================
+
+# Consult a local index of movie hashes before querying the OpenSubtitles.com API.
+# Can be enabled at run time with '--index' argument.
+# The index is populated with the results of your previous searches by hash,
+# and can also be fed with exported JSON files using the '--index-import' argument.
+opt_local_index = False
+
+# Directory used to store the local index (and other persistent data).
+# By default: '~/.cache/OpenSubtitlesDownload/' ('%LOCALAPPDATA%\OpenSubtitlesDownload\' on Windows).
+opt_cache_path = ''
+
+# ==== Work sharing settings ===================================================
+
+# Share the work with other computers processing the same library, using a directory on a shared storage
+# (ex: on your NAS, mounted at the same path on every computer). Each video file is claimed by one computer
+# before being processed, and the local index and the hash cache are shared (in its 'cache' directory).
+# Using '-i' is recommended, so videos already processed by another computer are skipped.
+# Can be overridden at run time with '--shared' argument.
+opt_shared_path = ''
+
+# Claims are refreshed every 'heartbeat' seconds. Claims that are not refreshed anymore (ex: the computer
+# holding them crashed) expire after 'timeout' seconds, and can then be taken over by another computer.
+opt_shared_heartbeat = 30
+opt_shared_claim_timeout = 300
+
+# ==== Catalog settings ========================================================
+
+# Keep a catalog of the scanned folders and video files (in the 'opt_cache_path' directory), so the next scans
+# only list the folders that changed, and only process the video files that are new or modified.
+# Video files already processed (with subtitles downloaded, or no subtitles found) are skipped, even when
+# 'opt_search_overwrite' is on. Video files without subtitles are still searched again, following 'opt_retry_schedule'.
+# Useful for large libraries scanned on a regular basis (ex: from a cron job).
+# Can be enabled at run time with '--catalog' argument.
+opt_catalog = False
+
+# ==== Retry schedule settings =================================================
+
+# Videos without subtitles in a language are not searched again on every run, but after increasing delays
+# (in seconds): 1 hour, 1 day, 3 days, 7 days, and then every 30 days. Empty to search them on every run.
+# Only honored in CLI mode (a video selected from a GUI is always searched).
+# Can be bypassed at run time with '--force' argument.
+opt_retry_schedule = [3600, 86400, 3*86400, 7*86400, 30*86400]
+
 # ==== GUI settings ============================================================
 
 # Select your GUI. Can be overridden at run time with '--gui=xxx' argument.
@@ -134,6 +260,10 @@ opt_gui = 'auto'
 opt_gui_width  = 940
 opt_gui_height = 480
 
+# Maximum number of subtitles shown at once in the GUI selection windows, from the best to the worst match
+# (according to the automatic selection). The remaining subtitles can be shown on demand. 0 to show them all.
+opt_selection_page_size = 100
+
 # Various GUI columns to show/hide during subtitles selection. You can set them to 'on', 'off' or 'auto'.
 opt_selection_language = 'auto'
 opt_selection_match    = 'auto'
@@ -142,17 +272,64 @@ opt_selection_fps      = 'off'
 opt_selection_rating   = 'off'
 opt_selection_count    = 'off'
 
+# While the selection window is open, log in to the API in the background, so the download starts right away.
+opt_prefetch_login = True
+
+# While the selection window is open, also resolve the download links of the N best ranked subtitles (according
+# to the automatic selection) and fetch them in the background. Can be overridden at run time with '--prefetch' argument.
+# WARNING: every resolved link counts against your download quota, even if you end up choosing another subtitles!
+opt_prefetch_count = 0
+
 # ==== Check file path & type ==================================================
 
+def isURL(path):
+    """Check if a video file is served over http(s)"""
+    return path.lower().startswith(('http://', 'https://'))
+
+def getURLFileName(url):
+    """Get the file name of a video file served over http(s)"""
+    return urllib.parse.unquote(urllib.parse.urlsplit(url).path.rsplit('/', 1)[-1])
+
+def getVideoLocalPath(path):
+    """Get the local path of a video file, used to name its subtitles. Video files served over http(s)
+    are placed into the output path (or the current directory), video files stored in an archive next to it"""
+    if isURL(path):
+        return os.path.join(os.path.abspath(opt_output_path or os.getcwd()), getURLFileName(path))
+    if isArchive(path):
+        archiveVideo = getArchiveVideo(path)
+        if archiveVideo:
+            return os.path.join(os.path.dirname(path), archiveVideo[0])
+    return path
+
+def getVideoInfo(path):
+    """Get the size and file name of a video file (maybe served over http(s), or stored in an archive)"""
+    if isURL(path):
+        return (getURLSize(path), getURLFileName(path))
+    if isArchive(path):
+        archiveVideo = getArchiveVideo(path)
+        if archiveVideo:
+            return (archiveVideo[1], archiveVideo[0])
+    return (os.path.getsize(path), os.path.basename(path))
+
 def checkFileValidity(path):
     """Check mimetype and/or file extension to detect valid video file"""
-    if os.path.isfile(path) is False:
+    if isURL(path):
+        path = getURLFileName(path)
+    elif os.path.isfile(path) is False:
         superPrint("info", "File not found", "The file provided was not found:\n<i>" + path + "</i>")
         return False
+    elif opt_search_archives and isArchive(path):
+        return getArchiveVideo(path) is not None
+
+    return isVideoFileName(path)
 
+def isVideoFileName(path):
+    """Check mimetype and/or file extension of a file name"""
     fileMimeType, encoding = mimetypes.guess_type(path)
     if fileMimeType is None:
         fileExtension = path.rsplit('.', 1)
+        if len(fileExtension) < 2:
+            return False
         if fileExtension[1] not in ['avi', 'mov', 'mp4', 'mp4v', 'm4v', 'mkv', 'mk3d', 'webm', \
                                     'ts', 'mts', 'm2ts', 'ps', 'vob', 'evo', 'mpeg', 'mpg', \
                                     'asf', 'wm', 'wmv', 'rm', 'rmvb', 'divx', 'xvid']:
@@ -177,6 +354,9 @@ def checkSubtitlesExists(path):
     if opt_language_suffix_separator not in sepList:
         sepList.append(opt_language_suffix_separator)
 
+    # The subtitles of a video file served over http(s) or stored in an archive are named after its local path
+    videoPath = getVideoLocalPath(path)
+
     if opt_language_suffix in ('on', 'auto'):
         for language in languageList:
             for sep in sepList:
@@ -184,72 +364,701 @@ def checkSubtitlesExists(path):
 
     for ext in extList:
         for teststring in tryList:
-            subPath = path.rsplit('.', 1)[0] + teststring + '.' + ext
+            subPath = videoPath.rsplit('.', 1)[0] + teststring + '.' + ext
             if os.path.isfile(subPath) is True:
                 superPrint("info", "Subtitles already downloaded!", "A subtitles file already exists for this file:\n<i>" + subPath + "</i>")
                 return True
 
+    if opt_search_embedded and videoPath == path:
+        trackLanguages = probeSubtitlesTracks(path)
+        for language in languageList:
+            if any(matchLanguageTag(language, trackLanguage) for trackLanguage in trackLanguages):
+                superPrint("info", "Subtitles already embedded!", "This file already contains '<b>" + language + "</b>' subtitles:\n<i>" + path + "</i>")
+                return True
+
     return False
 
+# ==== Check for embedded subtitles tracks =====================================
+# Only the headers of MKV (EBML) and MP4 (ISO BMFF) files are read: elements and
+# boxes containing the actual video data are skipped over.
+
+# ISO 639-2 (B and T) to ISO 639-1 language codes
+LANGUAGE_CODES = {
+    'alb': 'sq', 'sqi': 'sq', 'ara': 'ar', 'arm': 'hy', 'hye': 'hy', 'baq': 'eu', 'eus': 'eu', 'bos': 'bs',
+    'bul': 'bg', 'cat': 'ca', 'chi': 'zh', 'zho': 'zh', 'hrv': 'hr', 'cze': 'cs', 'ces': 'cs', 'dan': 'da',
+    'dut': 'nl', 'nld': 'nl', 'eng': 'en', 'est': 'et', 'fin': 'fi', 'fre': 'fr', 'fra': 'fr', 'geo': 'ka',
+    'kat': 'ka', 'ger': 'de', 'deu': 'de', 'gre': 'el', 'ell': 'el', 'heb': 'he', 'hin': 'hi', 'hun': 'hu',
+    'ice': 'is', 'isl': 'is', 'ind': 'id', 'ita': 'it', 'jpn': 'ja', 'kor': 'ko', 'lav': 'lv', 'lit': 'lt',
+    'mac': 'mk', 'mkd': 'mk', 'may': 'ms', 'msa': 'ms', 'nor': 'no', 'nob': 'no', 'nno': 'no', 'per': 'fa',
+    'fas': 'fa', 'pol': 'pl', 'por': 'pt', 'rum': 'ro', 'ron': 'ro', 'rus': 'ru', 'srp': 'sr', 'slo': 'sk',
+    'slk': 'sk', 'slv': 'sl', 'spa': 'es', 'swe': 'sv', 'tha': 'th', 'tur': 'tr', 'ukr': 'uk', 'vie': 'vi',
+}
+
+def readEbmlVarint(f, isId=False):
+    """Read an EBML variable size integer (element ID or element size)"""
+    first = f.read(1)
+    if not first:
+        return None
+    length = 1
+    mask = 0x80
+    while length <= 8 and not (first[0] & mask):
+        length += 1
+        mask >>= 1
+    if length > 8:
+        return None
+    value = first[0] if isId else first[0] & (mask - 1)
+    for byte in f.read(length - 1):
+        value = (value << 8) | byte
+    if not isId and value == (1 << (7 * length)) - 1:
+        return -1 # unknown size
+    return value
+
+def probeMatroska(f):
+    """List the languages of the subtitles tracks of a Matroska file"""
+    languages = []
+    f.seek(0)
+    if readEbmlVarint(f, True) != 0x1A45DFA3:
+        return languages
+    f.seek(readEbmlVarint(f), os.SEEK_CUR) # EBML header
+    if readEbmlVarint(f, True) != 0x18538067:
+        return languages
+    readEbmlVarint(f) # Segment size
+    segmentStart = f.tell()
+
+    # Find the Tracks element, directly or using the SeekHead
+    tracksPosition = None
+    while tracksPosition is None:
+        elementId = readEbmlVarint(f, True)
+        elementSize = readEbmlVarint(f)
+        if elementId is None or elementSize is None or elementSize < 0:
+            return languages
+        if elementId == 0x1654AE6B: # Tracks
+            tracksPosition = f.tell()
+            tracksSize = elementSize
+        elif elementId == 0x114D9B74: # SeekHead
+            seekHead = io.BytesIO(f.read(elementSize))
+            while seekHead.tell() < elementSize:
+                seekId = readEbmlVarint(seekHead, True)
+                seekSize = readEbmlVarint(seekHead)
+                if seekId is None or seekSize is None or seekSize < 0:
+                    break
+                if seekId != 0x4DBB: # Seek
+                    seekHead.seek(seekSize, os.SEEK_CUR)
+                    continue
+                seekEnd = seekHead.tell() + seekSize
+                seekTarget = None
+                seekPosition = None
+                while seekHead.tell() < seekEnd:
+                    childId = readEbmlVarint(seekHead, True)
+                    childSize = readEbmlVarint(seekHead)
+                    data = seekHead.read(childSize)
+                    if childId == 0x53AB: # SeekID
+                        seekTarget = int.from_bytes(data, 'big')
+                    elif childId == 0x53AC: # SeekPosition
+                        seekPosition = int.from_bytes(data, 'big')
+                if seekTarget == 0x1654AE6B and seekPosition is not None:
+                    f.seek(segmentStart + seekPosition)
+                    if readEbmlVarint(f, True) != 0x1654AE6B:
+                        return languages
+                    tracksSize = readEbmlVarint(f)
+                    tracksPosition = f.tell()
+                    break
+        elif elementId == 0x1F43B675: # Cluster: the video data, and no Tracks were found
+            return languages
+        else:
+            f.seek(elementSize, os.SEEK_CUR)
+
+    # Parse the TrackEntry elements
+    if tracksSize is None or tracksSize < 0:
+        return languages
+    f.seek(tracksPosition)
+    tracks = io.BytesIO(f.read(min(tracksSize, 1 << 20)))
+    while True:
+        entryId = readEbmlVarint(tracks, True)
+        entrySize = readEbmlVarint(tracks)
+        if entryId is None or entrySize is None or entrySize < 0:
+            break
+        entry = tracks.read(entrySize)
+        if entryId != 0xAE: # TrackEntry
+            continue
+        entry = io.BytesIO(entry)
+        trackType = 0
+        language = 'eng' # Matroska default
+        languageBCP47 = ''
+        while True:
+            childId = readEbmlVarint(entry, True)
+            childSize = readEbmlVarint(entry)
+            if childId is None or childSize is None or childSize < 0:
+                break
+            data = entry.read(childSize)
+            if childId == 0x83: # TrackType
+                trackType = int.from_bytes(data, 'big')
+            elif childId == 0x22B59C: # Language
+                language = data.decode('ascii', 'replace').strip('\x00')
+            elif childId == 0x22B59D: # LanguageBCP47
+                languageBCP47 = data.decode('ascii', 'replace').strip('\x00')
+        if trackType == 0x11: # subtitles
+            languages.append(languageBCP47 or language)
+
+    return languages
+
+def probeMp4(f):
+    """List the languages of the subtitles tracks of an MP4 file"""
+    def boxes(data):
+        offset = 0
+        while offset + 8 <= len(data):
+            size, boxType = struct.unpack('>I4s', data[offset:offset + 8])
+            header = 8
+            if size == 1:
+                size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+                header = 16
+            elif size == 0:
+                size = len(data) - offset
+            if size < header:
+                break
+            yield boxType, data[offset + header:offset + size]
+            offset += size
+
+    # Find the 'moov' box, skipping over the others (like 'mdat')
+    languages = []
+    f.seek(0, os.SEEK_END)
+    fileSize = f.tell()
+    offset = 0
+    moov = None
+    while offset + 8 <= fileSize:
+        f.seek(offset)
+        size, boxType = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = fileSize - offset
+        if size < header:
+            break
+        if boxType == b'moov':
+            moov = f.read(min(size - header, 64 << 20))
+            break
+        offset += size
+
+    for boxType, trak in boxes(moov or b''):
+        if boxType != b'trak':
+            continue
+        for boxType, mdia in boxes(trak):
+            if boxType != b'mdia':
+                continue
+            handler = b''
+            language = 'und'
+            for boxType, data in boxes(mdia):
+                if boxType == b'hdlr' and len(data) >= 12:
+                    handler = data[8:12]
+                elif boxType == b'mdhd' and len(data) >= 24:
+                    packed = struct.unpack('>H', data[32:34] if data[0] == 1 else data[20:22])[0]
+                    language = ''.join(chr(((packed >> shift) & 0x1F) + 0x60) for shift in (10, 5, 0))
+            if handler in [b'sbtl', b'subt', b'text', b'clcp']:
+                languages.append(language)
+
+    return languages
+
+def matchLanguageTag(language, trackLanguage):
+    """Check if a subtitles track language satisfies a wanted language: the primary
+    subtags must match, and the regions too when both carry one ('pt-BR' isn't 'pt-PT')"""
+    (primary, _, region) = language.lower().partition('-')
+    (trackPrimary, _, trackRegion) = trackLanguage.lower().partition('-')
+    return primary == trackPrimary and (not region or not trackRegion or region == trackRegion)
+
+def probeSubtitlesTracks(path):
+    """List the languages (ISO 639-1 codes when known, with their region if any) of the subtitles tracks embedded in a video file.
+    Results are cached in the local database, until the file is modified"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return []
+
+    try:
+        db = openDatabase()
+        db.execute('CREATE TABLE IF NOT EXISTS probe_cache (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, languages TEXT)')
+        row = db.execute('SELECT languages FROM probe_cache WHERE path = ? AND size = ? AND mtime = ?', (path, st.st_size, st.st_mtime)).fetchone()
+        if row:
+            metricsCountScan('cache_requests', {'cache': 'probe', 'result': 'hit'})
+            return json.loads(row[0])
+    except sqlite3.Error:
+        db = None
+    metricsCountScan('cache_requests', {'cache': 'probe', 'result': 'miss'})
+
+    languages = []
+    try:
+        with open(path, 'rb') as f:
+            magic = f.read(8)
+            if magic[0:4] == b'\x1a\x45\xdf\xa3':
+                languages = probeMatroska(f)
+            elif magic[4:8] in [b'ftyp', b'moov', b'mdat', b'free', b'wide']:
+                languages = probeMp4(f)
+    except (OSError, ValueError, struct.error):
+        pass
+
+    for i, language in enumerate(languages):
+        (primary, _, region) = language.lower().partition('-')
+        primary = LANGUAGE_CODES.get(primary, primary)
+        languages[i] = primary + '-' + region if region else primary
+
+    if db:
+        try:
+            with db:
+                db.execute('INSERT OR REPLACE INTO probe_cache VALUES (?, ?, ?, ?)', (path, st.st_size, st.st_mtime, json.dumps(languages)))
+        except sqlite3.Error:
+            pass
+
+    return languages
+
+# ==== Stored archives =========================================================
+# Video files stored (without compression) in RAR or ZIP archives can be hashed
+# without being extracted: their data is located inside the archive volumes, as a
+# list of extents (volume path, offset, length), and only the needed bytes are read.
+# Info: https://www.rarlab.com/technote.htm and https://pkware.cachefly.net/webdocs/casestudies/APPNOTE.TXT
+
+RAR_PART = re.compile(r'^(.*\.part)(\d+)\.rar$', re.IGNORECASE)
+
+archiveVideos = {}
+
+def isArchive(path):
+    """Check if a file is the first volume of a RAR or ZIP archive"""
+    part = RAR_PART.match(path)
+    if part:
+        return int(part.group(2)) == 1
+    return path.lower().endswith(('.rar', '.zip'))
+
+def getArchiveVolumes(path):
+    """List the volumes of an archive, from its first volume"""
+    volumes = [path]
+    part = RAR_PART.match(path)
+    if part: # new RAR naming: .part1.rar, .part2.rar...
+        number = 2
+        while os.path.isfile(part.group(1) + str(number).zfill(len(part.group(2))) + path[-4:]):
+            volumes.append(part.group(1) + str(number).zfill(len(part.group(2))) + path[-4:])
+            number += 1
+    elif path.lower().endswith('.rar'): # old RAR naming: .rar, .r00, .r01... .r99, .s00...
+        number = 0
+        while os.path.isfile(path[:-3] + chr(ord(path[-3]) + number // 100) + '%02d' % (number % 100)):
+            volumes.append(path[:-3] + chr(ord(path[-3]) + number // 100) + '%02d' % (number % 100))
+            number += 1
+    else: # split ZIP: .z01, .z02... and the .zip volume is the last one
+        number = 1
+        while os.path.isfile(path[:-2] + '%02d' % number):
+            volumes.insert(-1, path[:-2] + '%02d' % number)
+            number += 1
+    return volumes
+
+def readExtents(extents, offset, size):
+    """Read 'size' bytes at 'offset' of data stored as a list of extents"""
+    buf = b''
+    for volumePath, volumeOffset, length in extents:
+        if offset >= length:
+            offset -= length
+            continue
+        fd = os.open(volumePath, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            buf += readAt(fd, volumeOffset + offset, min(size - len(buf), length - offset))
+        finally:
+            os.close(fd)
+        offset = 0
+        if len(buf) == size:
+            return buf
+    raise IOError("Unexpected end of archive")
+
+def sliceExtents(extents, offset, length):
+    """Get the extents of a part of data stored as a list of extents"""
+    sliced = []
+    for volumePath, volumeOffset, volumeLength in extents:
+        if offset >= volumeLength:
+            offset -= volumeLength
+            continue
+        sliced.append((volumePath, volumeOffset + offset, min(length, volumeLength - offset)))
+        length -= sliced[-1][2]
+        offset = 0
+        if length <= 0:
+            break
+    return sliced
+
+def parseVint(data, pos):
+    """Parse a RAR5 variable length integer, return its value and the position after it"""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        value |= (byte & 0x7F) << shift
+        pos += 1
+        shift += 7
+        if not byte & 0x80:
+            return (value, pos)
+
+def parseRar4(f):
+    """List the files stored in a RAR 4 volume"""
+    entries = []
+    pos = 7
+    while True:
+        f.seek(pos)
+        head = f.read(7)
+        if len(head) < 7:
+            break
+        (headType, headFlags, headSize) = struct.unpack('<2xBHH', head)
+        if headSize < 7 or headType == 0x7B: # end of archive
+            break
+        if headType == 0x73 and headFlags & 0x0080: # encrypted headers
+            return []
+        addSize = 0
+        if headType == 0x74: # file
+            data = f.read(headSize - 7)
+            (packSize, unpSize) = struct.unpack('<II', data[0:8])
+            (method, nameSize) = struct.unpack('<BH', data[18:21])
+            nameStart = 25
+            if headFlags & 0x0100: # 64 bits sizes
+                (highPackSize, highUnpSize) = struct.unpack('<II', data[25:33])
+                packSize += highPackSize << 32
+                unpSize += highUnpSize << 32
+                nameStart = 33
+            name = data[nameStart:nameStart + nameSize].split(b'\0')[0].decode('utf-8', 'replace')
+            entries.append({'name': name, 'size': unpSize, 'offset': pos + headSize, 'length': packSize,
+                            'stored': method == 0x30, 'encrypted': bool(headFlags & 0x0004)})
+            addSize = packSize
+        elif headFlags & 0x8000:
+            addSize = struct.unpack('<I', f.read(4))[0]
+        pos += headSize + addSize
+    return entries
+
+def parseRar5(f):
+    """List the files stored in a RAR 5 volume"""
+    entries = []
+    pos = 8
+    while True:
+        f.seek(pos)
+        head = f.read(7)
+        if len(head) < 5:
+            break
+        (headSize, dataStart) = parseVint(head, 4)
+        data = f.read(max(0, dataStart + headSize - len(head)))
+        data = head[dataStart:] + data
+        if len(data) < headSize:
+            break
+        (headType, i) = parseVint(data, 0)
+        (headFlags, i) = parseVint(data, i)
+        extraSize = dataSize = 0
+        if headFlags & 0x0001:
+            (extraSize, i) = parseVint(data, i)
+        if headFlags & 0x0002:
+            (dataSize, i) = parseVint(data, i)
+        dataStart = pos + dataStart + headSize
+        if headType == 4: # encrypted headers
+            return []
+        if headType == 5: # end of archive
+            break
+        if headType == 2: # file
+            (fileFlags, i) = parseVint(data, i)
+            (unpSize, i) = parseVint(data, i)
+            (_, i) = parseVint(data, i) # attributes
+            if fileFlags & 0x0002: # mtime
+                i += 4
+            if fileFlags & 0x0004: # CRC32
+                i += 4
+            (compression, i) = parseVint(data, i)
+            (_, i) = parseVint(data, i) # host OS
+            (nameSize, i) = parseVint(data, i)
+            name = data[i:i + nameSize].decode('utf-8', 'replace')
+            # Look for an encryption record in the extra area
+            encrypted = False
+            i = headSize - extraSize
+            while i < headSize:
+                (recordSize, j) = parseVint(data, i)
+                (recordType, _) = parseVint(data, j)
+                encrypted = encrypted or recordType == 0x01
+                i = j + recordSize
+            entries.append({'name': name, 'size': unpSize, 'offset': dataStart, 'length': dataSize,
+                            'stored': (compression >> 7) & 0x07 == 0, 'encrypted': encrypted})
+        pos = dataStart + dataSize
+    return entries
+
+def parseZip(volumes):
+    """List the files stored in a (maybe split) ZIP archive"""
+    volumeExtents = [(volume, 0, os.path.getsize(volume)) for volume in volumes]
+    volumeStarts = [sum(extent[2] for extent in volumeExtents[:idx]) for idx in range(len(volumes))]
+
+    # Find the end of central directory record, at the end of the last volume
+    with open(volumes[-1], 'rb') as f:
+        f.seek(max(0, volumeExtents[-1][2] - 65536 - 22))
+        tail = f.read()
+    eocd = tail.rfind(b'PK\x05\x06')
+    if eocd < 0:
+        return []
+    (cdDisk, cdSize, cdOffset) = struct.unpack('<6xH4xII', tail[eocd:eocd + 20])
+    if eocd >= 20 and tail[eocd - 20:eocd - 16] == b'PK\x06\x07': # zip64
+        (zip64Disk, zip64Offset) = struct.unpack('<IQ', tail[eocd - 16:eocd - 4])
+        zip64 = readExtents(volumeExtents, volumeStarts[zip64Disk] + zip64Offset, 56)
+        (cdDisk, cdSize, cdOffset) = struct.unpack('<20xI16xQQ', zip64)
+    cd = readExtents(volumeExtents, volumeStarts[cdDisk] + cdOffset, cdSize)
+
+    entries = []
+    pos = 0
+    while cd[pos:pos + 4] == b'PK\x01\x02':
+        (flags, method, packSize, unpSize, nameSize, extraSize, commentSize, disk, localOffset) = \
+            struct.unpack('<8xHH8xIIHHHH6xI', cd[pos:pos + 46])
+        name = cd[pos + 46:pos + 46 + nameSize].decode('utf-8' if flags & 0x0800 else 'cp437', 'replace')
+        # zip64 extended information: only the fields too large for the record are present, in this order
+        extra = cd[pos + 46 + nameSize:pos + 46 + nameSize + extraSize]
+        i = 0
+        while i + 4 <= len(extra):
+            (recordType, recordSize) = struct.unpack('<HH', extra[i:i + 4])
+            if recordType == 0x0001:
+                j = i + 4
+                if unpSize == 0xFFFFFFFF:
+                    unpSize = struct.unpack('<Q', extra[j:j + 8])[0]
+                    j += 8
+                if packSize == 0xFFFFFFFF:
+                    packSize = struct.unpack('<Q', extra[j:j + 8])[0]
+                    j += 8
+                if localOffset == 0xFFFFFFFF:
+                    localOffset = struct.unpack('<Q', extra[j:j + 8])[0]
+                    j += 8
+                if disk == 0xFFFF:
+                    disk = struct.unpack('<I', extra[j:j + 4])[0]
+            i += 4 + recordSize
+        pos += 46 + nameSize + extraSize + commentSize
+
+        # The data follows the local file header, whose extra field may differ from the central directory one
+        localHeader = volumeStarts[disk] + localOffset
+        (localNameSize, localExtraSize) = struct.unpack('<HH', readExtents(volumeExtents, localHeader + 26, 4))
+        entries.append({'name': name, 'size': unpSize, 'length': packSize, 'stored': method == 0, 'encrypted': bool(flags & 0x0001),
+                        'extents': sliceExtents(volumeExtents, localHeader + 30 + localNameSize + localExtraSize, packSize)})
+    return entries
+
+def getArchiveVideo(path):
+    """Find the (largest) video file stored without compression in an archive.
+    Return its file name, size and extents, or None"""
+    if path in archiveVideos:
+        return archiveVideos[path]
+    archiveVideos[path] = None
+
+    try:
+        volumes = getArchiveVolumes(path)
+        entries = []
+        if path.lower().endswith('.zip'):
+            entries = parseZip(volumes)
+        else:
+            for volume in volumes:
+                with open(volume, 'rb') as f:
+                    signature = f.read(8)
+                    if signature.startswith(b'Rar!\x1a\x07\x00'):
+                        volumeEntries = parseRar4(f)
+                    elif signature == b'Rar!\x1a\x07\x01\x00':
+                        volumeEntries = parseRar5(f)
+                    else:
+                        break
+                for entry in volumeEntries:
+                    entry['extents'] = [(volume, entry['offset'], entry['length'])]
+                entries += volumeEntries
+
+        # Files split across volumes are listed once per volume
+        videos = {}
+        for entry in entries:
+            if entry['name'] in videos:
+                videos[entry['name']]['extents'] += entry['extents']
+                videos[entry['name']]['stored'] &= entry['stored'] and not entry['encrypted']
+            elif isVideoFileName(entry['name'].replace('\\', '/')):
+                videos[entry['name']] = {'size': entry['size'], 'extents': entry['extents'],
+                                         'stored': entry['stored'] and not entry['encrypted']}
+        if videos:
+            name = max(videos, key=lambda name: videos[name]['size'])
+            video = videos[name]
+            if video['stored'] and sum(extent[2] for extent in video['extents']) == video['size']:
+                archiveVideos[path] = (os.path.basename(name.replace('\\', '/')), video['size'], video['extents'])
+    except (OSError, IndexError, struct.error):
+        pass
+
+    return archiveVideos[path]
+
 # ==== Hashing algorithm =======================================================
 # Info: https://trac.opensubtitles.org/projects/opensubtitles/wiki/HashSourceCodes
 # This particular implementation is coming from SubDownloader: https://subdownloader.net
 
+def readAt(fd, offset, size):
+    """Read 'size' bytes at 'offset' of a file descriptor, without moving its file position when possible"""
+    buf = b''
+    while len(buf) < size:
+        if hasattr(os, 'pread'):
+            chunk = os.pread(fd, size - len(buf), offset + len(buf))
+        else:
+            os.lseek(fd, offset + len(buf), os.SEEK_SET)
+            chunk = os.read(fd, size - len(buf))
+        if not chunk:
+            raise IOError("Unexpected end of file")
+        buf += chunk
+    return buf
+
+httpConnections = threading.local()
+
+def httpRequest(url, method, headers=None):
+    """Send a request to a file server, reusing the connection of this thread to the same server.
+    The response is returned unread, it must be read (or its connection closed) by the caller"""
+    parts = urllib.parse.urlsplit(url)
+    key = (parts.scheme.lower(), parts.hostname, parts.port)
+    target = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+    headers = dict(headers or {})
+    if parts.username:
+        credentials = urllib.parse.unquote(parts.username) + ':' + urllib.parse.unquote(parts.password or '')
+        headers['Authorization'] = 'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii')
+
+    connections = getattr(httpConnections, 'connections', None)
+    if connections is None:
+        connections = httpConnections.connections = {}
+
+    for attempt in range(2):
+        connection = connections.get(key)
+        if connection is None:
+            if key[0] == 'https':
+                connection = http.client.HTTPSConnection(parts.hostname, parts.port, timeout=getTimeout(opt_timeout_read))
+            else:
+                connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=getTimeout(opt_timeout_read))
+            connections[key] = connection
+        try:
+            connection.request(method, target, headers=headers)
+            return connection.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            # The server may have closed a kept-alive connection, retry once with a new one
+            connection.close()
+            del connections[key]
+            if attempt > 0:
+                raise
+
+def getURLSize(url):
+    """Get the size of a file served over http(s), using a HEAD request"""
+    response = httpRequest(url, 'HEAD')
+    response.read()
+    if response.status != 200 or response.getheader('Content-Length') is None:
+        raise IOError("HTTP error " + str(response.status) + " while getting the size of " + url)
+    return int(response.getheader('Content-Length'))
+
+def readURL(url, offset, size):
+    """Read 'size' bytes at 'offset' of a file served over http(s), using a range request"""
+    response = httpRequest(url, 'GET', {'Range': 'bytes=%d-%d' % (offset, offset + size - 1)})
+    if response.status != 206:
+        # Don't download the whole file if the server doesn't support range requests
+        response.close()
+        raise IOError("HTTP error " + str(response.status) + " while reading " + url)
+    buf = response.read()
+    if len(buf) != size:
+        raise IOError("Unexpected end of file")
+    return buf
+
 def hashFile(path):
     """Produce a hash for a video file: size + 64bit chksum of the first and
-    last 64k (even if they overlap because the file is smaller than 128k)"""
+    last 64k (even if they overlap because the file is smaller than 128k).
+    Files served over http(s) are hashed using a HEAD and two range requests,
+    files stored in an archive are read directly from the archive volumes"""
     try:
         longlongformat = 'Q' # unsigned long long little endian
         bytesize = struct.calcsize(longlongformat)
         fmt = "<%d%s" % (65536//bytesize, longlongformat)
 
-        f = open(path, "rb")
-
-        filesize = os.fstat(f.fileno()).st_size
-        filehash = filesize
-
-        if filesize < 65536 * 2:
-            superPrint("error", "File size error!", "File size error while generating hash for this file:\n<i>" + path + "</i>")
-            return "SizeError"
-
-        buf = f.read(65536)
-        longlongs = struct.unpack(fmt, buf)
-        filehash += sum(longlongs)
-
-        f.seek(-65536, os.SEEK_END) # size is always > 131072
-        buf = f.read(65536)
-        longlongs = struct.unpack(fmt, buf)
-        filehash += sum(longlongs)
-        filehash &= 0xFFFFFFFFFFFFFFFF
+        fd = None
+        if isURL(path):
+            filesize = getURLSize(path)
+            readChunk = lambda offset: readURL(path, offset, 65536)
+        elif isArchive(path):
+            archiveVideo = getArchiveVideo(path)
+            if not archiveVideo:
+                raise IOError("No video file stored without compression in this archive")
+            filesize = archiveVideo[1]
+            readChunk = lambda offset: readExtents(archiveVideo[2], offset, 65536)
+        else:
+            fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            filesize = os.fstat(fd).st_size
+            readChunk = lambda offset: readAt(fd, offset, 65536)
+        try:
+            filehash = filesize
+
+            if filesize < 65536 * 2:
+                superPrint("error", "File size error!", "File size error while generating hash for this file:\n<i>" + path + "</i>")
+                metricsCountScan('files_hashed', {'result': 'size_error'})
+                return "SizeError"
+
+            # Only the first and last 64k are needed: disable readahead, and queue both reads at once
+            if fd is not None and hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_RANDOM)
+                os.posix_fadvise(fd, 0, 65536, os.POSIX_FADV_WILLNEED)
+                os.posix_fadvise(fd, filesize - 65536, 65536, os.POSIX_FADV_WILLNEED)
+
+            buf = readChunk(0)
+            longlongs = struct.unpack(fmt, buf)
+            filehash += sum(longlongs)
+
+            buf = readChunk(filesize - 65536) # size is always > 131072
+            longlongs = struct.unpack(fmt, buf)
+            filehash += sum(longlongs)
+            filehash &= 0xFFFFFFFFFFFFFFFF
+        finally:
+            if fd is not None:
+                os.close(fd)
 
-        f.close()
         returnedhash = "%016x" % filehash
+        metricsCountScan('files_hashed', {'result': 'ok'})
         return returnedhash
 
-    except IOError:
+    except (IOError, http.client.HTTPException):
         superPrint("error", "I/O error!", "Input/Output error while generating hash for this file:\n<i>" + path + "</i>")
+        metricsCountScan('files_hashed', {'result': 'io_error'})
         return "IOError"
 
     except Exception:
         print("Unexpected error (line " + str(sys.exc_info()[-1].tb_lineno) + "): " + str(sys.exc_info()[0]))
 
+def hashFiles(pathList):
+    """Hash a list of video files, grouped by storage device and sorted by inode.
+    Devices are read in parallel, with a limited number of concurrent reads per device.
+    Files served over http(s) are grouped by server, and each thread reuses its connections"""
+    devices = {}
+    for path in pathList:
+        if isURL(path):
+            devices.setdefault(urllib.parse.urlsplit(path).netloc.lower(), []).append((0, path))
+            continue
+        try:
+            st = os.stat(path)
+            devices.setdefault(st.st_dev, []).append((st.st_ino, path))
+        except OSError:
+            continue
+
+    hashes = {}
+
+    # When working with other computers, reuse the hashes they already computed
+    if opt_shared_path:
+        cached = hashCacheLookup(pathList)
+        hashes.update(cached)
+        for files in devices.values():
+            files[:] = [file for file in files if file[1] not in cached]
+
+    def hashDevice(files):
+        paths = [path for _, path in sorted(files)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, opt_hash_threads_per_device)) as executor:
+            for path, filehash in zip(paths, executor.map(hashFile, paths)):
+                hashes[path] = filehash
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(devices))) as executor:
+        list(executor.map(hashDevice, devices.values()))
+
+    if opt_shared_path:
+        hashCacheStore({path: filehash for path, filehash in hashes.items() if path not in cached})
+
+    return hashes
+
 # ==== String escaping =========================================================
 
 def escapeGUI(string):
+    """Escape the markup characters. zenity and kdialog are spawned without any shell,
+    so no other quoting is needed"""
     if opt_gui != 'cli':
-        string = string.replace('"', '\\"')
-        string = string.replace("'", "\\'")
-        string = string.replace('`', '\\`')
         string = string.replace("&", "&amp;")
+        string = string.replace("<", "&lt;")
+        string = string.replace(">", "&gt;")
     return string
 
-def escapePath(string):
-    if opt_gui != 'cli':
-        return escapeGUI(string)
-        return re.escape(string) # too much
-    else:
-        return string
-
 # ==== Super Print =============================================================
 # priority: info, warning, error
 # title: only for zenity and kdialog messages
@@ -257,9 +1066,14 @@ def escapePath(string):
 
 def superPrint(priority, title, message):
     """Print messages through terminal, zenity or kdialog"""
-    if opt_gui == 'gnome':
+    gui = opt_gui
+    if priority == 'error' and breakerTripped:
+        # The API is down and the user already knows it, do not flood the desktop with error dialogs
+        gui = 'cli'
+
+    if gui == 'gnome':
         subprocess.call(['zenity', '--width=' + str(opt_gui_width), '--' + priority, '--title=' + title, '--text=' + message])
-    elif opt_gui == 'kde':
+    elif gui == 'kde':
         # Adapt to kdialog
         message = message.replace("\n", "<br>")
         message = message.replace('\\"', '"')
@@ -281,160 +1095,299 @@ def superPrint(priority, title, message):
         # Print message
         print(">> " + message)
 
+# ==== Search results ==========================================================
+
+class SubtitlesResult:
+    """Compact record for a subtitles found by a search"""
+    __slots__ = ('file_id', 'file_name', 'language', 'hearing_impaired', 'ai_translated', 'machine_translated',
+                 'foreign_parts_only', 'ratings', 'download_count', 'fps', 'moviehash_match', 'movie_name')
+
+    def __init__(self, attributes):
+        self.file_id = attributes['files'][0]['file_id']
+        self.file_name = attributes['files'][0].get('file_name') or ''
+        self.language = attributes.get('language') or ''
+        self.hearing_impaired = attributes.get('hearing_impaired', False) == True
+        self.ai_translated = attributes.get('ai_translated', False) == True
+        self.machine_translated = attributes.get('machine_translated', False) == True
+        self.foreign_parts_only = attributes.get('foreign_parts_only', False) == True
+        self.ratings = attributes.get('ratings', 0.0)
+        self.download_count = attributes.get('download_count', 0)
+        self.fps = attributes.get('fps', 0.0)
+        self.moviehash_match = attributes.get('moviehash_match', False) == True
+        self.movie_name = (attributes.get('feature_details') or {}).get('movie_name') or ''
+
+def parseSearchResults(subtitlesResultList):
+    """Parse the search results (API format) into a list of records, applying the ignore filters"""
+    subtitlesList = []
+    if not subtitlesResultList or 'data' not in subtitlesResultList:
+        return subtitlesList
+
+    for item in subtitlesResultList['data']:
+        attributes = item['attributes']
+        if not attributes.get('files'):
+            continue
+        if opt_ignore_hi and attributes.get('hearing_impaired', False) == True:
+            continue
+        if opt_ignore_foreign_parts_only and attributes.get('foreign_parts_only', False) == True:
+            continue
+        if opt_ignore_ai_translated and attributes.get('ai_translated', False) == True:
+            continue
+        if opt_ignore_machine_translated and attributes.get('machine_translated', False) == True:
+            continue
+        subtitlesList.append(SubtitlesResult(attributes))
+
+    return subtitlesList
+
+def selectionPage(ranking, page):
+    """Get the subtitles indexes shown on a page of a selection window, and the number of subtitles after it"""
+    if opt_selection_page_size <= 0:
+        return (ranking, 0)
+    first = page * opt_selection_page_size
+    return (ranking[first:first + opt_selection_page_size], max(0, len(ranking) - first - opt_selection_page_size))
+
+# ==== Release name parsing ====================================================
+
+RELEASE_EPISODE = re.compile(r'^s(\d{1,2})e(\d{1,3})(?:-?e\d{1,3})*$|^(\d{1,2})x(\d{2,3})$', re.IGNORECASE)
+RELEASE_SEASON = re.compile(r'^(?:s|season)(\d{1,2})$', re.IGNORECASE)
+RELEASE_YEAR = re.compile(r'^\(?((?:19|20)\d{2})\)?$')
+RELEASE_RESOLUTION = re.compile(r'^(\d{3,4}[pi]|4k|uhd)$', re.IGNORECASE)
+RELEASE_SOURCE = re.compile(r'^(blu-?ray|bdrip|brrip|bdremux|remux|web-?dl|webrip|web|hdtv|pdtv|dvdrip|dvd|dvdscr|hdrip|hdcam|cam|ts|tc|amzn|nf|dsnp|hmax|atvp)$', re.IGNORECASE)
+RELEASE_EXTENSIONS = ['avi', 'mov', 'mp4', 'mp4v', 'm4v', 'mkv', 'mk3d', 'webm', 'ts', 'mts', 'm2ts', 'ps', 'vob', 'evo', 'mpeg', 'mpg',
+                      'asf', 'wm', 'wmv', 'rm', 'rmvb', 'divx', 'xvid', 'srt', 'sub', 'ssa', 'ass', 'vtt', 'smi', 'txt']
+RELEASE_GROUP = re.compile(r'-([A-Za-z0-9]+)(?:\[[^\]]*\])?$')
+
+def isReleaseTag(token):
+    """Check if a token of a release name is an episode, season, resolution or source tag"""
+    return bool(RELEASE_EPISODE.match(token) or RELEASE_SEASON.match(token) or
+                RELEASE_RESOLUTION.match(token) or RELEASE_SOURCE.match(token))
+
+def parseReleaseName(fileName):
+    """Extract title, year, season, episode, resolution, source and group from a release name"""
+    release = {'title': '', 'year': None, 'season': None, 'episode': None, 'resolution': '', 'source': '', 'group': ''}
+
+    name = fileName
+    if '.' in name and name.rsplit('.', 1)[1].lower() in RELEASE_EXTENSIONS:
+        name = name.rsplit('.', 1)[0]
+
+    # Release group, at the end after a dash (but 'WEB-DL' is a source), only in names with
+    # a year or release tags before it ('Spider-Man' has no release group)
+    group = RELEASE_GROUP.search(name)
+    if group:
+        lastToken = re.split(r'[\s._]+', name)[-1]
+        isSource = RELEASE_SOURCE.match(lastToken) or RELEASE_SOURCE.match('-'.join(lastToken.split('-')[-2:]))
+        tokens = [token for token in re.split(r'[\s._\[\]]+', name[:group.start()]) if token]
+        isRelease = any(isReleaseTag(token) for token in tokens) or any(RELEASE_YEAR.match(token) for token in tokens[1:])
+        if isRelease and not isSource and not RELEASE_RESOLUTION.match(group.group(1)):
+            release['group'] = group.group(1).lower()
+            name = name[:group.start()]
+
+    tokens = [token for token in re.split(r'[\s._\[\]]+', name) if token]
+    titleEnd = len(tokens)
+    for idx, token in enumerate(tokens):
+        episode = RELEASE_EPISODE.match(token)
+        season = RELEASE_SEASON.match(token)
+        if episode and release['episode'] is None:
+            release['season'] = int(episode.group(1) or episode.group(3))
+            release['episode'] = int(episode.group(2) or episode.group(4))
+        elif season and release['season'] is None:
+            release['season'] = int(season.group(1))
+        elif RELEASE_RESOLUTION.match(token) and not release['resolution']:
+            release['resolution'] = token.lower()
+        elif RELEASE_SOURCE.match(token) and not release['source']:
+            release['source'] = token.lower().replace('-', '')
+        else:
+            continue
+        titleEnd = min(titleEnd, idx)
+
+    # The year is the last year-like token of the title (ex: 'Blade.Runner.2049.2017')
+    for idx in range(titleEnd - 1, 0, -1):
+        year = RELEASE_YEAR.match(tokens[idx])
+        if year:
+            release['year'] = int(year.group(1))
+            titleEnd = idx
+            break
+
+    release['title'] = ' '.join(tokens[:titleEnd]).strip(' -')
+    return release
+
+def getReleaseSearchParams(fileName):
+    """Get structured search parameters from a release name, or the raw filename if it can't be parsed"""
+    release = parseReleaseName(fileName)
+    if not opt_search_release_parsing or not release['title']:
+        return {'query': fileName}
+
+    params = {'query': release['title'].lower()}
+    if release['season'] is not None:
+        params['season_number'] = release['season']
+    if release['episode'] is not None:
+        params['episode_number'] = release['episode']
+    if release['year'] is not None and release['season'] is None:
+        params['year'] = release['year']
+    return params
+
 # ==== GNOME selection window ==================================================
 
-def selectionGnome(subtitlesResultList):
-    """GNOME subtitles selection window using zenity"""
+def selectionGnome(subtitlesList):
+    """GNOME subtitles selection window using zenity.
+    Subtitles are sorted by score, and sent to zenity through its standard input"""
     subtitlesSelectedName = u''
     subtitlesSelectedIndex = -1
 
-    subtitlesItems = u''
     subtitlesMatchedByHash = 0
     subtitlesMatchedByName = 0
-    columnHi = ''
-    columnLn = ''
-    columnMatch = ''
-    columnRate = ''
-    columnCount = ''
-    columnFPS = ''
-
-    # Generate selection window content
-    for idx, item in enumerate(subtitlesResultList['data']):
-        if opt_ignore_hi and item['attributes'].get('hearing_impaired', False) == True:
-            continue
-        if opt_ignore_foreign_parts_only and item['attributes'].get('foreign_parts_only', False) == True:
-            continue
-        if opt_ignore_ai_translated and item['attributes'].get('ai_translated', False) == True:
-            continue
-        if opt_ignore_machine_translated and item['attributes'].get('machine_translated', False) == True:
-            continue
-
-        if item['attributes'].get('moviehash_match', False) == True:
+    columns = ['--column=id', '--column=Available subtitles']
+
+    if opt_selection_hi == 'on':
+        columns.append('--column=HI')
+    if opt_selection_language == 'on':
+        columns.append('--column=Language')
+    if opt_selection_match == 'on':
+        columns.append('--column=MatchedBy')
+    if opt_selection_rating == 'on':
+        columns.append('--column=Rating')
+    if opt_selection_count == 'on':
+        columns.append('--column=Downloads')
+    if opt_selection_fps == 'on':
+        columns.append('--column=FPS')
+
+    for sub in subtitlesList:
+        if sub.moviehash_match:
             subtitlesMatchedByHash += 1
         else:
             subtitlesMatchedByName += 1
 
-        subtitlesItems += f'{idx} "' + escapeGUI(item['attributes']['files'][0]['file_name']) + '" '
-
-        if opt_selection_hi == 'on':
-            columnHi = '--column="HI" '
-            if item['attributes'].get('hearing_impaired', False) == True:
-                subtitlesItems += u'"✔" '
-            else:
-                subtitlesItems += '"" '
-        if opt_selection_language == 'on':
-            columnLn = '--column="Language" '
-            subtitlesItems += '"' + item['attributes']['language'] + '" '
-        if opt_selection_match == 'on':
-            columnMatch = '--column="MatchedBy" '
-            if item['attributes'].get('moviehash_match', False) == True:
-                subtitlesItems += '"HASH" '
-            else:
-                subtitlesItems += '"name" '
-        if opt_selection_rating == 'on':
-            columnRate = '--column="Rating" '
-            subtitlesItems += '"' + str(item['attributes']['ratings']) + '" '
-        if opt_selection_count == 'on':
-            columnCount = '--column="Downloads" '
-            subtitlesItems += '"' + str(item['attributes']['download_count']).zfill(5) + '" '
-        if opt_selection_fps == 'on':
-            columnFPS = '--column="FPS" '
-            subtitlesItems += '"' + str(item['attributes']['fps']) + '" '
-
     if subtitlesMatchedByName == 0:
-        tilestr = ' --title="Subtitles for: ' + videoTitle + '"'
-        textstr = ' --text="<b>Video title:</b> ' + videoTitle + '\n<b>File name:</b> ' + videoFileName + '"'
+        tilestr = 'Subtitles for: ' + videoTitle
+        textstr = '<b>Video title:</b> ' + videoTitle + '\n<b>File name:</b> ' + videoFileName
     elif subtitlesMatchedByHash == 0:
-        tilestr = ' --title="Subtitles for: ' + videoFileName + '"'
-        textstr = ' --text="Search results using file name, NOT video detection. <b>May be unreliable...</b>\n<b>File name:</b> ' + videoFileName + '" '
+        tilestr = 'Subtitles for: ' + videoFileName
+        textstr = 'Search results using file name, NOT video detection. <b>May be unreliable...</b>\n<b>File name:</b> ' + videoFileName
     else: # a mix of the two
-        tilestr = ' --title="Subtitles for: ' + videoTitle + '"'
-        textstr = ' --text="Search results using file name AND video detection.\n<b>Video title:</b> ' + videoTitle + '\n<b>File name:</b> ' + videoFileName + '"'
-
-    # Spawn zenity "list" dialog
-    process_subtitlesSelection = subprocess.Popen('zenity --width=' + str(opt_gui_width) + ' --height=' + str(opt_gui_height) + ' --list' + tilestr + textstr
-                                                  + ' --column "id" --column="Available subtitles" ' + columnHi + columnLn + columnMatch + columnRate + columnCount + columnFPS + subtitlesItems
-                                                  + ' --hide-column=1 --print-column=ALL', shell=True, stdout=subprocess.PIPE)
-
-    # Get back the user's choice
-    result_subtitlesSelection = process_subtitlesSelection.communicate()
-
-    # The results contain a subtitles?
-    if result_subtitlesSelection[0]:
-        result = str(result_subtitlesSelection[0], 'utf-8', 'replace').strip("\n")
-
-        # Get index and result
-        [subtitlesSelectedIndex, subtitlesSelectedName] = result.split('|')[0:2]
-    else:
-        if process_subtitlesSelection.returncode == 0:
-            subtitlesSelectedName = subtitlesResultList['data'][0]['attributes']['files'][0]['file_name']
-            subtitlesSelectedIndex = 0
+        tilestr = 'Subtitles for: ' + videoTitle
+        textstr = 'Search results using file name AND video detection.\n<b>Video title:</b> ' + videoTitle + '\n<b>File name:</b> ' + videoFileName
+
+    ranking = rankSubtitles(subtitlesList, languageList)
+    page = 0
+
+    while True:
+        (pageRanking, remaining) = selectionPage(ranking, page)
+
+        # Generate selection window content, one cell per line
+        subtitlesItems = []
+        for idx in pageRanking:
+            sub = subtitlesList[idx]
+            subtitlesItems += [str(idx), sub.file_name]
+
+            if opt_selection_hi == 'on':
+                subtitlesItems.append(u'✔' if sub.hearing_impaired else '')
+            if opt_selection_language == 'on':
+                subtitlesItems.append(sub.language)
+            if opt_selection_match == 'on':
+                subtitlesItems.append('HASH' if sub.moviehash_match else 'name')
+            if opt_selection_rating == 'on':
+                subtitlesItems.append(str(sub.ratings))
+            if opt_selection_count == 'on':
+                subtitlesItems.append(str(sub.download_count).zfill(5))
+            if opt_selection_fps == 'on':
+                subtitlesItems.append(str(sub.fps))
+
+        if remaining > 0:
+            subtitlesItems += ['more', 'More results... (' + str(remaining) + ' remaining)'] + [''] * (len(columns) - 2)
+
+        # Spawn zenity "list" dialog
+        process_subtitlesSelection = subprocess.Popen(['zenity', '--width=' + str(opt_gui_width), '--height=' + str(opt_gui_height), '--list',
+                                                       '--title=' + tilestr, '--text=' + textstr] + columns + ['--hide-column=1', '--print-column=ALL'],
+                                                      stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        # Get back the user's choice
+        subtitlesItems = ''.join(str(item).replace('\n', ' ') + '\n' for item in subtitlesItems)
+        result_subtitlesSelection = process_subtitlesSelection.communicate(subtitlesItems.encode('utf-8'))
+
+        # The results contain a subtitles?
+        if result_subtitlesSelection[0]:
+            result = str(result_subtitlesSelection[0], 'utf-8', 'replace').strip("\n")
+
+            # Get index and result
+            [subtitlesSelectedIndex, subtitlesSelectedName] = result.split('|')[0:2]
+            if subtitlesSelectedIndex == 'more':
+                page += 1
+                continue
+            subtitlesSelectedIndex = int(subtitlesSelectedIndex)
+        else:
+            if process_subtitlesSelection.returncode == 0 and pageRanking:
+                subtitlesSelectedIndex = pageRanking[0]
+                subtitlesSelectedName = subtitlesList[subtitlesSelectedIndex].file_name
+        break
 
     # Return the result (selected subtitles name and index)
     return (subtitlesSelectedName, subtitlesSelectedIndex)
 
 # ==== KDE selection window ====================================================
 
-def selectionKDE(subtitlesResultList):
-    """KDE subtitles selection window using kdialog"""
+def selectionKDE(subtitlesList):
+    """KDE subtitles selection window using kdialog.
+    Subtitles are sorted by score, and passed to kdialog as arguments"""
     subtitlesSelectedName = u''
     subtitlesSelectedIndex = -1
 
-    subtitlesItems = u''
     subtitlesMatchedByHash = 0
     subtitlesMatchedByName = 0
 
-    # Generate selection window content
-    # TODO doesn't support additional columns
-    index = 0
-
-    for idx, item in enumerate(subtitlesResultList['data']):
-        if opt_ignore_hi and item['attributes'].get('hearing_impaired', False) == True:
-            continue
-        if opt_ignore_foreign_parts_only and item['attributes'].get('foreign_parts_only', False) == True:
-            continue
-        if opt_ignore_ai_translated and item['attributes'].get('ai_translated', False) == True:
-            continue
-        if opt_ignore_machine_translated and item['attributes'].get('machine_translated', False) == True:
-            continue
-
-        if item['attributes'].get('moviehash_match', False) == True:
+    for sub in subtitlesList:
+        if sub.moviehash_match:
             subtitlesMatchedByHash += 1
         else:
             subtitlesMatchedByName += 1
 
-        # key + subtitles name
-        subtitlesItems += str(index) + ' "' + item['attributes']['files'][0]['file_name'] + '" '
-        index += 1
-
     if subtitlesMatchedByName == 0:
-        tilestr = ' --title="Subtitles for ' + videoTitle + '"'
-        menustr = ' --menu="<b>Video title:</b> ' + videoTitle + '<br><b>File name:</b> ' + videoFileName + '" '
+        tilestr = 'Subtitles for ' + videoTitle
+        menustr = '<b>Video title:</b> ' + videoTitle + '<br><b>File name:</b> ' + videoFileName
     elif subtitlesMatchedByHash == 0:
-        tilestr = ' --title="Subtitles for ' + videoFileName + '"'
-        menustr = ' --menu="Search results using file name, NOT video detection. <b>May be unreliable...</b><br><b>File name:</b> ' + videoFileName + '" '
+        tilestr = 'Subtitles for ' + videoFileName
+        menustr = 'Search results using file name, NOT video detection. <b>May be unreliable...</b><br><b>File name:</b> ' + videoFileName
     else: # a mix of the two
-        tilestr = ' --title="Subtitles for ' + videoTitle + '" '
-        menustr = ' --menu="Search results using file name AND video detection.<br><b>Video title:</b> ' + videoTitle + '<br><b>File name:</b> ' + videoFileName + '" '
-
-    # Spawn kdialog "radiolist"
-    process_subtitlesSelection = subprocess.Popen('kdialog --geometry=' + str(opt_gui_width) + 'x' + str(opt_gui_height) + '+0+0' + tilestr + menustr + subtitlesItems,
-                                                  shell=True, stdout=subprocess.PIPE)
-
-    # Get back the user's choice
-    result_subtitlesSelection = process_subtitlesSelection.communicate()
-
-    # The results contain the key matching a subtitles?
-    if result_subtitlesSelection[0]:
-        subtitlesSelectedIndex = int(str(result_subtitlesSelection[0], 'utf-8', 'replace').strip("\n"))
-        subtitlesSelectedName = subtitlesResultList['data'][subtitlesSelectedIndex]['attributes']['files'][0]['file_name']
+        tilestr = 'Subtitles for ' + videoTitle
+        menustr = 'Search results using file name AND video detection.<br><b>Video title:</b> ' + videoTitle + '<br><b>File name:</b> ' + videoFileName
+
+    ranking = rankSubtitles(subtitlesList, languageList)
+    page = 0
+
+    while True:
+        (pageRanking, remaining) = selectionPage(ranking, page)
+
+        # Generate selection window content: key + subtitles name
+        # TODO doesn't support additional columns
+        subtitlesItems = []
+        for idx in pageRanking:
+            subtitlesItems += [str(idx), subtitlesList[idx].file_name]
+
+        if remaining > 0:
+            subtitlesItems += ['more', 'More results... (' + str(remaining) + ' remaining)']
+
+        # Spawn kdialog "menu"
+        process_subtitlesSelection = subprocess.Popen(['kdialog', '--geometry=' + str(opt_gui_width) + 'x' + str(opt_gui_height) + '+0+0',
+                                                       '--title=' + tilestr, '--menu=' + menustr] + subtitlesItems,
+                                                      stdout=subprocess.PIPE)
+
+        # Get back the user's choice
+        result_subtitlesSelection = process_subtitlesSelection.communicate()
+
+        # The results contain the key matching a subtitles?
+        if result_subtitlesSelection[0]:
+            result = str(result_subtitlesSelection[0], 'utf-8', 'replace').strip("\n")
+            if result == 'more':
+                page += 1
+                continue
+            subtitlesSelectedIndex = int(result)
+            subtitlesSelectedName = subtitlesList[subtitlesSelectedIndex].file_name
+        break
 
     # Return the result (selected subtitles name and index)
     return (subtitlesSelectedName, subtitlesSelectedIndex)
 
 # ==== CLI selection mode ======================================================
 
-def selectionCLI(subtitlesResultList):
+def selectionCLI(subtitlesList):
     """Command Line Interface, subtitles selection inside your current terminal"""
     subtitlesSelectedName = u''
     subtitlesSelectedIndex = -1
@@ -443,8 +1396,8 @@ def selectionCLI(subtitlesResultList):
     subtitlesMatchedByName = 0
 
     # Check if search has results by hash or name
-    for item in subtitlesResultList['data']:
-        if item['attributes'].get('moviehash_match', False) == True:
+    for sub in subtitlesList:
+        if sub.moviehash_match:
             subtitlesMatchedByHash += 1
         else:
             subtitlesMatchedByName += 1
@@ -462,40 +1415,31 @@ def selectionCLI(subtitlesResultList):
     print("\n>> Available subtitles:")
 
     # Print subtitles list on the terminal
-    for idx, item in enumerate(subtitlesResultList['data']):
-        if opt_ignore_hi and item['attributes'].get('hearing_impaired', False) == True:
-            continue
-        if opt_ignore_foreign_parts_only and item['attributes'].get('foreign_parts_only', False) == True:
-            continue
-        if opt_ignore_ai_translated and item['attributes'].get('ai_translated', False) == True:
-            continue
-        if opt_ignore_machine_translated and item['attributes'].get('machine_translated', False) == True:
-            continue
-
+    for idx, sub in enumerate(subtitlesList):
         subtitlesItemPre = u'> '
-        subtitlesItem = u'"' + item['attributes']['files'][0]['file_name'] + u'"'
+        subtitlesItem = u'"' + sub.file_name + u'"'
         subtitlesItemPost = u''
 
         if opt_selection_match == 'on':
-            if item['attributes'].get('moviehash_match', False) == True:
+            if sub.moviehash_match:
                 subtitlesItemPre += '(hash) > '
             else:
                 subtitlesItemPre += '(name) > '
         if opt_selection_language == 'on':
-            subtitlesItemPre += item['attributes']['language'].upper() + ' > '
+            subtitlesItemPre += sub.language.upper() + ' > '
 
-        if opt_selection_hi == 'on' and item['attributes'].get('hearing_impaired', False) == True:
+        if opt_selection_hi == 'on' and sub.hearing_impaired:
             subtitlesItemPost += ' > ' + '\033[44m' + ' HI ' + '\033[0m'
         if opt_selection_fps == 'on':
-            subtitlesItemPost += ' > ' + '\033[100m' + str(item['attributes']['fps']) + ' FPS' + '\033[0m'
+            subtitlesItemPost += ' > ' + '\033[100m' + str(sub.fps) + ' FPS' + '\033[0m'
         if opt_selection_rating == 'on':
-            subtitlesItemPost += ' > ' + '\033[100m' + 'Rating: ' + str(item['attributes']['ratings']) + '\033[0m'
+            subtitlesItemPost += ' > ' + '\033[100m' + 'Rating: ' + str(sub.ratings) + '\033[0m'
         if opt_selection_count == 'on':
-            subtitlesItemPost += ' > ' + '\033[100m' + 'Downloads: ' + str(item['attributes']['download_count']) + '\033[0m'
+            subtitlesItemPost += ' > ' + '\033[100m' + 'Downloads: ' + str(sub.download_count) + '\033[0m'
 
         idx += 1 # We display subtitles indexes starting from 1, 0 is reserved for cancel
 
-        if item['attributes'].get('moviehash_match', False) == True:
+        if sub.moviehash_match:
             print("\033[92m[" + str(idx).rjust(2, ' ') + "]\033[0m " + subtitlesItemPre + subtitlesItem + subtitlesItemPost)
         else:
             print("\033[93m[" + str(idx).rjust(2, ' ') + "]\033[0m " + subtitlesItemPre + subtitlesItem + subtitlesItemPost)
@@ -515,39 +1459,57 @@ def selectionCLI(subtitlesResultList):
         return ("", -1)
 
     subtitlesSelectedIndex -= 1
-    subtitlesSelectedName = subtitlesResultList['data'][subtitlesSelectedIndex]['attributes']['files'][0]['file_name']
+    subtitlesSelectedName = subtitlesList[subtitlesSelectedIndex].file_name
 
     # Return the result (selected subtitles name and index)
     return (subtitlesSelectedName, subtitlesSelectedIndex)
 
 # ==== Automatic selection mode ================================================
 
-def selectionAuto(subtitlesResultList, languageList):
-    """Automatic subtitles selection using filename match"""
-    subtitlesSelectedName = u''
-    subtitlesSelectedIndex = -1
-
-    videoFileParts = videoFileName.replace('-', '.').replace(' ', '.').replace('_', '.').lower().split('.')
+def rankSubtitles(subtitlesList, languageList):
+    """Sort subtitles indexes from the best to the worst filename match"""
+    # Count video filename parts once, instead of comparing them with every subtitles filename parts
+    videoFileParts = {}
+    for filePart in videoFileName.replace('-', '.').replace(' ', '.').replace('_', '.').lower().split('.'):
+        videoFileParts[filePart] = videoFileParts.get(filePart, 0) + 1
     languageListReversed = list(reversed(languageList))
-    maxScore = -1
+    videoRelease = parseReleaseName(videoFileName)
+    scores = []
 
-    for idx, item in enumerate(subtitlesResultList['data']):
+    for sub in subtitlesList:
         score = 0
         # points to respect languages priority
-        score += languageListReversed.index(item['attributes']['language']) * 100
+        if sub.language in languageListReversed:
+            score += languageListReversed.index(sub.language) * 100
         # extra point if the sub is found by hash
-        if item['attributes'].get('moviehash_match', False) == True:
+        if sub.moviehash_match:
             score += 1
         # points for filename mach
-        subFileParts = item['attributes']['files'][0]['file_name'].replace('-', '.').replace(' ', '.').replace('_', '.').lower().split('.')
-        for subPart in subFileParts:
-            for filePart in videoFileParts:
-                if subPart == filePart:
-                    score += 1
-        if score > maxScore:
-            maxScore = score
-            subtitlesSelectedIndex = idx
-            subtitlesSelectedName = subtitlesResultList['data'][subtitlesSelectedIndex]['attributes']['files'][0]['file_name']
+        for subPart in sub.file_name.replace('-', '.').replace(' ', '.').replace('_', '.').lower().split('.'):
+            score += videoFileParts.get(subPart, 0)
+        # points for release match: same release group and source are likely in sync, another episode is useless
+        subRelease = parseReleaseName(sub.file_name)
+        if videoRelease['group'] and subRelease['group'] == videoRelease['group']:
+            score += 2
+        if videoRelease['source'] and subRelease['source'] == videoRelease['source']:
+            score += 1
+        if (videoRelease['episode'] is not None and subRelease['episode'] is not None and
+            (subRelease['season'], subRelease['episode']) != (videoRelease['season'], videoRelease['episode'])):
+            score -= 50
+        scores.append(score)
+
+    # Sort is stable: in case of equal scores, the first result wins
+    return sorted(range(len(subtitlesList)), key=lambda idx: -scores[idx])
+
+def selectionAuto(subtitlesList, languageList):
+    """Automatic subtitles selection using filename match"""
+    subtitlesSelectedName = u''
+    subtitlesSelectedIndex = -1
+
+    ranking = rankSubtitles(subtitlesList, languageList)
+    if ranking:
+        subtitlesSelectedIndex = ranking[0]
+        subtitlesSelectedName = subtitlesList[subtitlesSelectedIndex].file_name
 
     # Return the result (selected subtitles name and index)
     return (subtitlesSelectedName, subtitlesSelectedIndex)
@@ -571,9 +1533,458 @@ def dependencyChecker():
                 return False
     return True
 
+# ==== Metrics =================================================================
+# Every instance collects its own metrics. Dispatched instances write them into a
+# spool directory when they exit, the dispatching instance merges them all into
+# the metrics file (at the end of the run, and periodically during long runs).
+
+METRICS_PREFIX = 'opensubtitlesdownload_'
+METRICS_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+metricsLock = threading.Lock()
+metricsData = {'counters': {}, 'gauges': {}, 'histograms': {}}
+metricsSpoolPath = ''
+metricsLastWrite = 0
+dispatchedProcesses = []
+
+def metricsKey(name, labels):
+    return name + '|' + json.dumps(labels or {}, sort_keys=True)
+
+def metricsCount(name, labels=None, value=1):
+    """Increment a counter"""
+    key = metricsKey(name, labels)
+    with metricsLock:
+        metricsData['counters'][key] = metricsData['counters'].get(key, 0) + value
+
+def metricsCountScan(name, labels=None):
+    """Increment a scan or hash counter, in the dispatching instance only
+    (the dispatched instances scan their video file again)"""
+    if not arguments.metrics_spool:
+        metricsCount(name, labels)
+
+def metricsGauge(name, value, labels=None):
+    """Set a gauge (the most recent value wins when merging instances)"""
+    with metricsLock:
+        metricsData['gauges'][metricsKey(name, labels)] = [value, time.time()]
+
+def metricsObserve(name, value, labels=None):
+    """Add an observation to a histogram"""
+    key = metricsKey(name, labels)
+    with metricsLock:
+        histogram = metricsData['histograms'].setdefault(key, [[0] * len(METRICS_BUCKETS), 0.0, 0])
+        for idx, bucket in enumerate(METRICS_BUCKETS):
+            if value <= bucket:
+                histogram[0][idx] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+def metricsMerge(merged, data):
+    """Merge the metrics of an instance into another set of metrics"""
+    for key, value in data['counters'].items():
+        merged['counters'][key] = merged['counters'].get(key, 0) + value
+    for key, value in data['gauges'].items():
+        if key not in merged['gauges'] or merged['gauges'][key][1] < value[1]:
+            merged['gauges'][key] = value
+    for key, value in data['histograms'].items():
+        histogram = merged['histograms'].setdefault(key, [[0] * len(METRICS_BUCKETS), 0.0, 0])
+        histogram[0] = [a + b for a, b in zip(histogram[0], value[0])]
+        histogram[1] += value[1]
+        histogram[2] += value[2]
+
+def metricsFormat(data):
+    """Format metrics using the Prometheus text format"""
+    def sample(key, suffix='', extra=None):
+        name, labels = key.split('|', 1)
+        labels = json.loads(labels)
+        labels.update(extra or {})
+        labelstr = ','.join(k + '="' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for k, v in sorted(labels.items()))
+        return METRICS_PREFIX + name + suffix + ('{' + labelstr + '}' if labelstr else '')
+
+    lines = []
+    typed = set()
+    def declare(key, metricType, suffix=''):
+        name = METRICS_PREFIX + key.split('|', 1)[0] + suffix
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE ' + name + ' ' + metricType)
+
+    for key in sorted(data['counters']):
+        declare(key, 'counter', '_total')
+        lines.append(sample(key, '_total') + ' ' + str(data['counters'][key]))
+    for key in sorted(data['gauges']):
+        declare(key, 'gauge')
+        lines.append(sample(key) + ' ' + str(data['gauges'][key][0]))
+    for key in sorted(data['histograms']):
+        declare(key, 'histogram')
+        buckets, total, count = data['histograms'][key]
+        for bucket, value in zip(METRICS_BUCKETS, buckets):
+            lines.append(sample(key, '_bucket', {'le': str(bucket)}) + ' ' + str(value))
+        lines.append(sample(key, '_bucket', {'le': '+Inf'}) + ' ' + str(count))
+        lines.append(sample(key, '_sum') + ' ' + str(round(total, 6)))
+        lines.append(sample(key, '_count') + ' ' + str(count))
+
+    return '\n'.join(lines) + '\n'
+
+def metricsWrite():
+    """Merge the metrics of every instance, and (atomically) write the metrics file"""
+    global metricsLastWrite
+    merged = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    with metricsLock:
+        metricsMerge(merged, metricsData)
+    for spoolFile in os.listdir(metricsSpoolPath):
+        try:
+            with open(os.path.join(metricsSpoolPath, spoolFile), 'r', encoding='utf-8') as f:
+                metricsMerge(merged, json.load(f))
+        except (OSError, ValueError):
+            continue
+
+    # Cache hit ratios
+    for cache in ['local_index', 'probe', 'hash']:
+        hits = merged['counters'].get(metricsKey('cache_requests', {'cache': cache, 'result': 'hit'}), 0)
+        misses = merged['counters'].get(metricsKey('cache_requests', {'cache': cache, 'result': 'miss'}), 0)
+        if hits + misses > 0:
+            merged['gauges'][metricsKey('cache_hit_ratio', {'cache': cache})] = [round(hits / (hits + misses), 4), time.time()]
+    merged['gauges'][metricsKey('last_run_timestamp_seconds', None)] = [int(time.time()), time.time()]
+
+    tmpPath = opt_metrics_path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmpPath, 'w', encoding='utf-8') as f:
+        f.write(metricsFormat(merged))
+    os.replace(tmpPath, opt_metrics_path)
+    metricsLastWrite = time.monotonic()
+
+def metricsRefresh():
+    """Periodically refresh the metrics file during long runs"""
+    if opt_metrics_path and time.monotonic() - metricsLastWrite >= opt_metrics_interval:
+        try:
+            metricsWrite()
+        except OSError as err:
+            print("Metrics error: " + str(err))
+
+def metricsFinish():
+    """At exit: spool the metrics of a dispatched instance, or write the metrics file"""
+    try:
+        if arguments.metrics_spool:
+            with open(os.path.join(arguments.metrics_spool, str(os.getpid()) + '.json'), 'w', encoding='utf-8') as f:
+                with metricsLock:
+                    json.dump(metricsData, f)
+        elif opt_metrics_path:
+            # Wait for the dispatched instances
+            while any(process.poll() is None for process in dispatchedProcesses):
+                metricsRefresh()
+                time.sleep(1)
+            metricsWrite()
+            shutil.rmtree(metricsSpoolPath, ignore_errors=True)
+    except OSError as err:
+        print("Metrics error: " + str(err))
+
+# ==== Profiling ===============================================================
+# Profile a run with cProfile (pstats output), a sampler of every thread stacks
+# (collapsed stacks, for flamegraph.pl or speedscope), and tracemalloc (top memory
+# allocation sites). Dispatched instances are profiled too, each in its own files.
+
+profiler = None
+profilerThreads = []
+profilerSamples = {}
+profilerSampler = None
+profilerStop = threading.Event()
+
+def profileThread(frame, event, arg):
+    """Enable a profiler in every new thread (Python < 3.12 profilers are per-thread)"""
+    threadProfiler = cProfile.Profile()
+    profilerThreads.append(threadProfiler)
+    threadProfiler.enable()
+
+def profileSampler(interval):
+    """Periodically sample the stacks of every thread"""
+    samplerId = threading.get_ident()
+    while not profilerStop.wait(interval):
+        for ident, frame in sys._current_frames().items():
+            if ident == samplerId:
+                continue
+            stack = []
+            while frame:
+                stack.append(frame.f_code.co_name + ' (' + os.path.basename(frame.f_code.co_filename) + ':' + str(frame.f_code.co_firstlineno) + ')')
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            profilerSamples[key] = profilerSamples.get(key, 0) + 1
+
+def profileStart(path):
+    """Start profiling this instance"""
+    global profiler, profilerSampler
+    os.makedirs(path, exist_ok=True)
+    tracemalloc.start(16)
+    profilerSampler = threading.Thread(target=profileSampler, args=(0.005,), daemon=True)
+    profilerSampler.start()
+    if sys.version_info < (3, 12):
+        threading.setprofile(profileThread)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    atexit.register(profileFinish, path)
+
+def profileFinish(path):
+    """Stop profiling, and write the results"""
+    profiler.disable()
+    # Wait for the sampler, so the samples don't change while they are written
+    profilerStop.set()
+    profilerSampler.join()
+    prefix = os.path.join(path, APP_NAME + '-' + str(os.getpid()))
+
+    try:
+        stats = pstats.Stats(profiler)
+        for threadProfiler in profilerThreads:
+            try:
+                stats.add(threadProfiler)
+            except TypeError:
+                pass # this thread didn't run any code
+        stats.dump_stats(prefix + '.pstats')
+
+        with open(prefix + '.collapsed', 'w', encoding='utf-8') as f:
+            for stack, count in sorted(profilerSamples.items()):
+                f.write(stack + ' ' + str(count) + '\n')
+
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        with open(prefix + '.memory.txt', 'w', encoding='utf-8') as f:
+            f.write('Current: ' + str(current) + ' bytes, peak: ' + str(peak) + ' bytes\n\n')
+            for stat in snapshot.statistics('lineno')[:30]:
+                f.write(str(stat) + '\n')
+        tracemalloc.stop()
+
+        print(">> Profiling results written to: " + prefix + ".*")
+    except OSError as err:
+        print("Profiling error: " + str(err))
+
+# ==== Network requests ========================================================
+
+fileDeadline = 0
+hedgeExecutor = None
+
+def getTimeout(timeout):
+    """Clamp a timeout to the time left before the current file deadline"""
+    if fileDeadline:
+        remaining = fileDeadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Deadline exceeded for this file")
+        return min(timeout, remaining)
+    return timeout
+
+def isTransientError(err):
+    """Check if a request error is worth a retry"""
+    if isinstance(err, urllib.error.HTTPError):
+        return err.code == 429 or err.code >= 500
+    return isinstance(err, (urllib.error.URLError, ConnectionError, TimeoutError, http.client.HTTPException))
+
+class ReadTimeoutConnection:
+    """Mixin for http.client connections: connect (and TLS handshake) using the
+    connection timeout, then switch the socket to the read timeout before sending"""
+    readTimeout = None
+
+    def connect(self):
+        super().connect()
+        self.sock.settimeout(self.readTimeout)
+
+class ReadTimeoutHTTPConnection(ReadTimeoutConnection, http.client.HTTPConnection):
+    pass
+
+class ReadTimeoutHTTPSConnection(ReadTimeoutConnection, http.client.HTTPSConnection):
+    pass
+
+class ReadTimeoutHTTPHandler(urllib.request.HTTPHandler):
+    def __init__(self, readTimeout, connections):
+        super().__init__()
+        self.readTimeout = readTimeout
+        self.connections = connections
+
+    def connection(self, connectionClass):
+        """Connection factory for do_open(), keeping track of the opened connections"""
+        def factory(host, **kwargs):
+            conn = connectionClass(host, **kwargs)
+            conn.readTimeout = self.readTimeout
+            self.connections.append(conn)
+            return conn
+        return factory
+
+    def http_open(self, req):
+        return self.do_open(self.connection(ReadTimeoutHTTPConnection), req)
+
+class ReadTimeoutHTTPSHandler(urllib.request.HTTPSHandler):
+    def __init__(self, readTimeout, connections):
+        super().__init__()
+        self.readTimeout = readTimeout
+        self.connections = connections
+
+    connection = ReadTimeoutHTTPHandler.connection
+
+    def https_open(self, req):
+        return self.do_open(self.connection(ReadTimeoutHTTPSConnection), req, context=self._context)
+
+def urlopenRequest(req, connections=None):
+    """Perform a single request, using connect and read timeouts, and return the response body"""
+    if connections is None:
+        connections = []
+    readTimeout = getTimeout(opt_timeout_read)
+    opener = urllib.request.build_opener(ReadTimeoutHTTPHandler(readTimeout, connections),
+                                         ReadTimeoutHTTPSHandler(readTimeout, connections))
+    with opener.open(req, timeout=getTimeout(opt_timeout_connect)) as response:
+        return response.read()
+
+def abortConnections(connections):
+    """Abort the requests using these connections, waking up any thread blocked on them"""
+    for conn in connections:
+        try:
+            if conn.sock:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+def hedgedRequest(req):
+    """Perform a request, and send a duplicate one if the first is too slow to answer"""
+    global hedgeExecutor
+    if hedgeExecutor is None:
+        # Room for an aborted request still winding down
+        hedgeExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+    connections = {}
+    futures = [hedgeExecutor.submit(urlopenRequest, req, connections.setdefault(0, []))]
+    done, _ = concurrent.futures.wait(futures, timeout=opt_hedge_delay)
+    if not done:
+        duplicate = urllib.request.Request(req.full_url, data=req.data, headers=req.headers, method=req.get_method())
+        futures.append(hedgeExecutor.submit(urlopenRequest, duplicate, connections.setdefault(1, [])))
+
+    # The first successful answer wins, the other request is aborted
+    error = None
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            response = future.result()
+        except Exception as err:
+            error = err
+            continue
+        for index, other in enumerate(futures):
+            if other is not future:
+                other.cancel()
+                abortConnections(connections[index])
+        return response
+    raise error
+
+def apiRequest(req, idempotent=False, hedge=False):
+    """Perform an API request, retrying idempotent requests on transient errors"""
+    attempts = 1 + (opt_retries if idempotent else 0)
+    delay = opt_retry_delay
+
+    # Metrics endpoint label: the API endpoint, or 'file' for subtitles files
+    endpoint = req.full_url[len(API_URL):].split('?')[0] if req.full_url.startswith(API_URL) else 'file'
+
+    for attempt in range(attempts):
+        breakerWait()
+        requestStart = time.monotonic()
+        try:
+            if hedge and opt_hedge_delay > 0:
+                response = hedgedRequest(req)
+            else:
+                response = urlopenRequest(req)
+            breakerReport(True)
+            metricsCount('api_requests', {'endpoint': endpoint, 'status': 'ok'})
+            metricsObserve('api_request_duration_seconds', time.monotonic() - requestStart, {'endpoint': endpoint})
+            return response
+        except Exception as err:
+            status = 'http_' + str(err.code) if isinstance(err, urllib.error.HTTPError) else type(err).__name__.lower()
+            metricsCount('api_requests', {'endpoint': endpoint, 'status': status})
+            metricsObserve('api_request_duration_seconds', time.monotonic() - requestStart, {'endpoint': endpoint})
+            if isinstance(err, urllib.error.HTTPError) and err.code != 429 and err.code < 500:
+                breakerReport(True) # the server is up, the request is wrong
+            elif fileDeadline and time.monotonic() >= fileDeadline:
+                pass # our own deadline ran out (or clamped the timeout), not the server's fault
+            elif isTransientError(err) and not (isinstance(err, urllib.error.HTTPError) and err.code == 429):
+                breakerReport(False)
+            if attempt + 1 >= attempts or not isTransientError(err):
+                raise
+            # Honor the server's delay when rate limited
+            if isinstance(err, urllib.error.HTTPError) and err.headers and str(err.headers.get('Retry-After', '')).isdigit():
+                delay = max(delay, int(err.headers.get('Retry-After')))
+            if fileDeadline and time.monotonic() + delay >= fileDeadline:
+                raise
+            time.sleep(delay)
+            delay *= 2
+
+# ==== Circuit breaker =========================================================
+# The breaker state is shared by all running instances through the local database.
+# After too many consecutive failures the breaker "opens": requests are paused,
+# and only one instance at a time is allowed to probe the API, once per interval.
+
+breakerTripped = False
+breakerReady = False
+
+def breakerDatabase():
+    """Open the local database, creating the circuit breaker table if needed"""
+    global breakerReady
+    db = openDatabase()
+    if not breakerReady:
+        with db:
+            db.execute('CREATE TABLE IF NOT EXISTS circuit_breaker (id INTEGER PRIMARY KEY CHECK (id = 0), failures INTEGER, next_probe REAL)')
+            db.execute('INSERT OR IGNORE INTO circuit_breaker VALUES (0, 0, 0)')
+        breakerReady = True
+    return db
+
+def breakerWait(probe=True):
+    """Wait until the API is considered reachable, or until this instance is allowed to probe it"""
+    global breakerTripped, fileDeadline
+    if opt_breaker_threshold <= 0:
+        return
+    start = time.monotonic()
+
+    while True:
+        try:
+            db = breakerDatabase()
+            with db:
+                db.execute('BEGIN IMMEDIATE')
+                failures, nextProbe = db.execute('SELECT failures, next_probe FROM circuit_breaker').fetchone()
+                if failures < opt_breaker_threshold:
+                    break
+                breakerTripped = True
+                if time.time() >= nextProbe:
+                    if probe:
+                        # This instance probes the API, the others wait for the next interval
+                        db.execute('UPDATE circuit_breaker SET next_probe = ?', (time.time() + opt_breaker_probe_interval,))
+                    break
+        except sqlite3.Error:
+            return # no shared state, no circuit breaker
+
+        if time.monotonic() - start > opt_breaker_max_wait:
+            raise ConnectionError("The OpenSubtitles.com API is unreachable")
+        time.sleep(max(0.5, min(nextProbe - time.time(), 5)))
+
+    # The time spent waiting for the API doesn't count against the file deadline
+    if fileDeadline:
+        fileDeadline += time.monotonic() - start
+
+def breakerReport(success):
+    """Report the outcome of a request to the circuit breaker"""
+    if opt_breaker_threshold <= 0:
+        return
+    try:
+        db = breakerDatabase()
+        if success:
+            # Only write when there is something to reset, the database is shared by all instances
+            if db.execute('SELECT failures FROM circuit_breaker').fetchone()[0] > 0:
+                with db:
+                    db.execute('UPDATE circuit_breaker SET failures = 0')
+            return
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            failures = db.execute('SELECT failures FROM circuit_breaker').fetchone()[0] + 1
+            db.execute('UPDATE circuit_breaker SET failures = ?, next_probe = ?', (failures, time.time() + opt_breaker_probe_interval))
+    except sqlite3.Error:
+        return
+
+    # The instance tripping the breaker tells the user, once
+    if failures == opt_breaker_threshold:
+        superPrint("warning", "OpenSubtitles.com unreachable!",
+                   "The OpenSubtitles.com API seems to be down.\n" +
+                   "The search will resume automatically when it is back (checking every " + str(opt_breaker_probe_interval) + " seconds).")
+
 # ==== REST API helpers ========================================================
 
-def getUserToken(username, password):
+def getUserToken(username, password, quiet=False):
     try:
         headers = {
             "User-Agent": f"{APP_NAME} v{APP_VERSION}",
@@ -588,17 +1999,20 @@ def getUserToken(username, password):
 
         data = json.dumps(payload).encode('utf-8')
         req = urllib.request.Request(API_URL_LOGIN, data=data, headers=headers)
-        with urllib.request.urlopen(req) as response:
-            response_data = json.loads(response.read().decode('utf-8'))
+        response_data = json.loads(apiRequest(req, idempotent=True).decode('utf-8'))
 
         #print("getUserToken() response data: " + str(response_data))
         return response_data['token']
 
     except (urllib.error.HTTPError, urllib.error.URLError) as err:
+        if quiet:
+            return None
         print("Urllib error (", err.code, ") ", err.reason)
         superPrint("error", "OpenSubtitles.com login error!", "An error occurred while connecting to the OpenSubtitles.com server")
         sys.exit(2)
     except Exception:
+        if quiet:
+            return None
         print("Unexpected error (line " + str(sys.exc_info()[-1].tb_lineno) + "): " + str(sys.exc_info()[0]))
         superPrint("error", "OpenSubtitles.com login error!", "An error occurred while connecting to the OpenSubtitles.com server")
         sys.exit(2)
@@ -614,8 +2028,7 @@ def destroyUserToken(USER_TOKEN):
         }
 
         req = urllib.request.Request(API_URL_LOGOUT, headers=headers)
-        with urllib.request.urlopen(req) as response:
-            response_data = json.loads(response.read().decode('utf-8'))
+        response_data = json.loads(apiRequest(req).decode('utf-8'))
 
         #print("destroyUserToken() response data: " + str(response_data))
         return response_data
@@ -632,11 +2045,11 @@ def searchSubtitles(**kwargs):
             "Api-key": f"{APP_API_KEY}"
         }
 
-        query_params = urllib.parse.urlencode(kwargs)
+        # Parameters sorted (and values lowercased by callers) as recommended by the API, to avoid redirections
+        query_params = urllib.parse.urlencode(sorted(kwargs.items()))
         url = f"{API_URL_SEARCH}?{query_params}"
         req = urllib.request.Request(url, headers=headers)
-        with urllib.request.urlopen(req) as response:
-            response_data = json.loads(response.read().decode('utf-8'))
+        response_data = json.loads(apiRequest(req, idempotent=True, hedge=True).decode('utf-8'))
 
         #print("searchSubtitles() response data: " + str(response_data))
         return response_data
@@ -661,8 +2074,10 @@ def getSubtitlesInfo(USER_TOKEN, file_id):
 
         data = json.dumps(payload).encode('utf-8')
         req = urllib.request.Request(API_URL_DOWNLOAD, data=data, headers=headers)
-        with urllib.request.urlopen(req) as response:
-            response_data = json.loads(response.read().decode('utf-8'))
+        response_data = json.loads(apiRequest(req).decode('utf-8'))
+
+        if 'remaining' in response_data:
+            metricsGauge('quota_remaining', response_data['remaining'])
 
         #print("getSubtitlesInfo() response data:" + response_data)
         return response_data
@@ -672,22 +2087,25 @@ def getSubtitlesInfo(USER_TOKEN, file_id):
     except Exception:
         print("Unexpected error (line " + str(sys.exc_info()[-1].tb_lineno) + "): " + str(sys.exc_info()[0]))
 
-def downloadSubtitles(USER_TOKEN, subURL, subPath):
-    try:
-        headers = {
-            "User-Agent": f"{APP_NAME} v{APP_VERSION}",
-            "Api-key": f"{APP_API_KEY}",
-            "Authorization": f"Bearer {USER_TOKEN}",
-            "Accept": "application/json",
-            "Content-Type": "application/json"
-        }
+def fetchSubtitles(USER_TOKEN, subURL):
+    headers = {
+        "User-Agent": f"{APP_NAME} v{APP_VERSION}",
+        "Api-key": f"{APP_API_KEY}",
+        "Authorization": f"Bearer {USER_TOKEN}",
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    }
 
-        req = urllib.request.Request(subURL, headers=headers)
-        with urllib.request.urlopen(req) as response:
-            decodedStr = response.read().decode('utf-8')
-            byteswritten = open(subPath, 'w', encoding='utf-8', errors='replace').write(decodedStr)
-            if byteswritten > 0:
-                return 0
+    req = urllib.request.Request(subURL, headers=headers)
+    return apiRequest(req, idempotent=True).decode('utf-8')
+
+def downloadSubtitles(USER_TOKEN, subURL, subPath, decodedStr=None):
+    try:
+        if decodedStr is None:
+            decodedStr = fetchSubtitles(USER_TOKEN, subURL)
+        byteswritten = open(subPath, 'w', encoding='utf-8', errors='replace').write(decodedStr)
+        if byteswritten > 0:
+            return 0
 
         return 1
 
@@ -696,7 +2114,644 @@ def downloadSubtitles(USER_TOKEN, subURL, subPath):
     except Exception:
         print("Unexpected error (line " + str(sys.exc_info()[-1].tb_lineno) + "): " + str(sys.exc_info()[0]))
 
+# ==== Subtitles search ========================================================
+
+def searchVideo(videoHash, videoSize, videoFileName):
+    """Search subtitles for a video, in the local index and/or online, depending on the search mode"""
+    subtitlesResultList = []
+    videoHashValid = videoHash not in [None, 'SizeError', 'IOError']
+    indexHit = False
+
+    ## Search for subtitles in the local index
+    if opt_local_index and opt_search_mode != 'filename' and videoHashValid:
+        try:
+            subtitlesResultList = indexLookup(videoHash, videoSize, languageList) or []
+            indexHit = bool(subtitlesResultList)
+            metricsCount('cache_requests', {'cache': 'local_index', 'result': 'hit' if indexHit else 'miss'})
+        except sqlite3.Error as err:
+            print("Local index error: " + str(err))
+
+    ## Search for subtitles online
+    def searchOnline(**kwargs):
+        # A failed search must not be mistaken for a search without results
+        results = searchSubtitles(**kwargs)
+        if results is None:
+            raise ConnectionError("Unable to search subtitles online")
+        return results
+
+    if subtitlesResultList:
+        pass # already found in the local index
+    elif (opt_search_mode == 'hash_and_filename'):
+        subtitlesResultList = searchOnline(moviehash=videoHash, languages=opt_languages, **getReleaseSearchParams(videoFileName))
+        #print(f"SEARCH BY HASH AND NAME >>>>> length {len(subtitlesResultList['data'])} >>>>> {subtitlesResultList['data']}")
+    else:
+        if any(mode in opt_search_mode for mode in ['hash_then_filename', 'hash']):
+            subtitlesResultList = searchOnline(moviehash=videoHash, languages=opt_languages)
+            #print(f"SEARCH BY HASH >>>>> length {len(subtitlesResultList['data'])} >>>>> {subtitlesResultList['data']}")
+        if ((opt_search_mode == 'filename') or
+            (opt_search_mode == 'hash_then_filename' and len(subtitlesResultList['data']) == 0)):
+            searchParams = getReleaseSearchParams(videoFileName)
+            subtitlesResultList = searchOnline(languages=opt_languages, **searchParams)
+            if len(subtitlesResultList['data']) == 0 and searchParams['query'] != videoFileName:
+                # Nothing found using the parsed release name, try the raw filename
+                subtitlesResultList = searchOnline(query=videoFileName, languages=opt_languages)
+            #print(f"SEARCH BY NAME >>>>> length {len(subtitlesResultList['data'])} >>>>> {subtitlesResultList['data']}")
+
+    metricsCount('files_searched')
+
+    ## Populate the local index with the subtitles found online by hash
+    if opt_local_index and videoHashValid and not indexHit:
+        try:
+            indexStore(videoHash, videoSize, subtitlesResultList)
+        except sqlite3.Error as err:
+            print("Local index error: " + str(err))
+
+    return subtitlesResultList
+
+def getSubtitlesPath(videoPath, language, subSuffix):
+    """Get the path of the subtitles file for a video"""
+    videoPath = getVideoLocalPath(videoPath)
+
+    if opt_output_path and os.path.isdir(os.path.abspath(opt_output_path)):
+        # Use the output path provided by the user
+        subPath = os.path.abspath(opt_output_path) + "/" + videoPath.rsplit('.', 1)[0].rsplit('/', 1)[1] + '.' + subSuffix
+    else:
+        # Use the path of the input video, and the suffix of the subtitles file
+        subPath = videoPath.rsplit('.', 1)[0] + '.' + subSuffix
+
+    # Write language code into the filename?
+    if opt_language_suffix == 'on':
+        subPath = subPath.rsplit('.', 1)[0] + opt_language_suffix_separator + language + '.' + subSuffix
 
+    return subPath
+
+# ==== Plan and apply ==========================================================
+# The plan file is a JSON document listing, for each video, the subtitles selected
+# automatically and where to save them. The 'apply' phase updates the 'status' of
+# each entry, so an interrupted (or quota limited) run can be applied again later.
+
+def writePlan(planPath, videoPathList, videoHashList):
+    """Search and select subtitles for a list of videos, and write the plan file"""
+    global videoFileName
+    entries = []
+
+    # Lookup every video in the local index at once
+    indexResults = {}
+    if opt_local_index and opt_search_mode != 'filename':
+        try:
+            indexResults = indexLookupBulk([(videoHashList.get(path), getVideoInfo(path)[0]) for path in videoPathList], languageList)
+        except sqlite3.Error as err:
+            print("Local index error: " + str(err))
+
+    for videoPath in videoPathList:
+        videoHash = videoHashList.get(videoPath) or hashFile(videoPath)
+        (videoSize, videoFileName) = getVideoInfo(videoPath)
+
+        try:
+            subtitlesResultList = indexResults.get((videoHash, videoSize)) or searchVideo(videoHash, videoSize, videoFileName)
+            subtitlesList = parseSearchResults(subtitlesResultList)
+        except Exception:
+            metricsCount('files_failed', {'reason': 'search_error'})
+            print(">> Search error for: " + videoPath)
+            continue
+
+        # Delay the next search of the languages without subtitles
+        if opt_retry_schedule:
+            try:
+                retryUpdate(videoHash, languageList, subtitlesList)
+            except sqlite3.Error as err:
+                print("Retry schedule error: " + str(err))
+
+        (subName, subIndex) = selectionAuto(subtitlesList, languageList)
+        if not subName:
+            metricsCount('files_failed', {'reason': 'no_subtitles'})
+            print(">> No subtitles found for: " + videoPath)
+            continue
+
+        sub = subtitlesList[subIndex]
+        entries.append({'video': videoPath, 'moviehash': videoHash, 'moviebytesize': videoSize,
+                        'file_id': sub.file_id, 'file_name': sub.file_name, 'language': sub.language,
+                        'moviehash_match': sub.moviehash_match,
+                        'subtitles_path': getSubtitlesPath(videoPath, sub.language, 'srt'),
+                        'status': 'planned'})
+        print(">> Planned '" + sub.language + "' subtitles for: " + videoPath)
+
+    savePlan(planPath, {'version': 1, 'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                        'languages': opt_languages, 'entries': entries})
+    print(">> " + str(len(entries)) + " subtitles planned, out of " + str(len(videoPathList)) + " videos")
+    return 0 if entries else 1
+
+def savePlan(planPath, plan):
+    """Write (atomically) a plan file"""
+    tmpPath = planPath + '.' + str(os.getpid()) + '.tmp'
+    with open(tmpPath, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, indent=1)
+    os.replace(tmpPath, planPath)
+
+def applyPlan(planPath):
+    """Download the subtitles listed in a plan file, as long as the download quota allows it"""
+    with open(planPath, 'r', encoding='utf-8') as f:
+        plan = json.load(f)
+
+    entries = [entry for entry in plan['entries'] if entry.get('status') != 'downloaded']
+    if not entries:
+        print(">> Nothing left to download in this plan")
+        return 1
+
+    USER_TOKEN = getUserToken(username=osd_username, password=osd_password)
+    downloaded = 0
+    errors = 0
+    lastDownload = 0
+
+    try:
+        for entry in entries:
+            # The plan may have been written on another machine
+            if not os.path.isdir(os.path.dirname(entry['subtitles_path'])):
+                entry['status'] = 'missing_path'
+                continue
+
+            # Rate limiting
+            time.sleep(max(0, lastDownload + opt_apply_interval - time.monotonic()))
+            lastDownload = time.monotonic()
+
+            fileInfo = getSubtitlesInfo(USER_TOKEN, entry['file_id'])
+            if not fileInfo or 'link' not in fileInfo:
+                entry['status'] = 'error'
+                errors += 1
+                if errors >= 3:
+                    print(">> Too many errors, stopping (download quota exhausted?)")
+                    break
+                continue
+            errors = 0
+
+            subSuffix = fileInfo['link'].split('?')[0].split('.')[-1]
+            subPath = entry['subtitles_path'].rsplit('.', 1)[0] + '.' + subSuffix
+            if downloadSubtitles(USER_TOKEN, fileInfo['link'], subPath) == 0:
+                entry['status'] = 'downloaded'
+                downloaded += 1
+                metricsCount('files_downloaded')
+                print(">> Downloaded '" + entry['language'] + "' subtitles: " + subPath)
+            else:
+                entry['status'] = 'error'
+                metricsCount('files_failed', {'reason': 'download_error'})
+
+            if fileInfo.get('remaining', 1) <= 0:
+                print(">> Download quota exhausted, apply this plan again after the quota reset")
+                break
+    finally:
+        savePlan(planPath, plan)
+
+    print(">> " + str(downloaded) + " subtitles downloaded, " + str(len([e for e in plan['entries'] if e.get('status') != 'downloaded'])) + " remaining in this plan")
+    return 0 if downloaded else 1
+
+# ==== Speculative prefetch ====================================================
+# While the user is choosing a subtitles, log in and pre-resolve the best ranked
+# candidates in a background thread. Resolving a download link consumes quota, so
+# only 'opt_prefetch_count' candidates are resolved (none by default).
+
+prefetchThread = None
+prefetchStop = threading.Event()
+prefetchResults = {'token': None, 'links': {}, 'contents': {}}
+
+def prefetchWorker(subtitlesList, ranking):
+    """Background login and download links resolution"""
+    prefetchResults['token'] = getUserToken(username=osd_username, password=osd_password, quiet=True)
+    if not prefetchResults['token']:
+        return
+
+    for idx in ranking[:opt_prefetch_count]:
+        if prefetchStop.is_set():
+            break
+        fileId = subtitlesList[idx].file_id
+        fileInfo = getSubtitlesInfo(prefetchResults['token'], fileId)
+        if not fileInfo or 'link' not in fileInfo:
+            break
+        prefetchResults['links'][fileId] = fileInfo
+        try:
+            prefetchResults['contents'][fileId] = fetchSubtitles(prefetchResults['token'], fileInfo['link'])
+        except Exception:
+            pass # the link is still valid, the download will be done again later
+
+def prefetchStart(subtitlesList, languageList):
+    """Start prefetching while the selection window is open"""
+    global prefetchThread
+    if not opt_prefetch_login and opt_prefetch_count <= 0:
+        return
+    ranking = rankSubtitles(subtitlesList, languageList)
+    prefetchThread = threading.Thread(target=prefetchWorker, args=(subtitlesList, ranking), daemon=True)
+    prefetchThread.start()
+
+def prefetchFinish():
+    """Stop prefetching new candidates, and wait for the current one"""
+    prefetchStop.set()
+    if prefetchThread:
+        prefetchThread.join()
+    return prefetchResults
+
+# ==== Local database ==========================================================
+
+databaseConnections = threading.local()
+
+def getCachePath():
+    """Get (and create if needed) the directory used to store persistent data"""
+    if opt_cache_path:
+        path = os.path.abspath(os.path.expanduser(opt_cache_path))
+    elif os.name == 'nt':
+        path = os.path.join(os.environ.get('LOCALAPPDATA', os.path.expanduser('~')), APP_NAME)
+    else:
+        path = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), APP_NAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def openDatabase(shared=False):
+    """Open (only once per thread) the SQLite database used to store persistent data.
+    When working with other computers, 'shared' data is stored in a database on the shared storage"""
+    shared = shared and bool(opt_shared_path)
+    name = 'shared' if shared else 'local'
+    if getattr(databaseConnections, name, None) is None:
+        if shared:
+            path = os.path.join(opt_shared_path, 'cache')
+            os.makedirs(path, exist_ok=True)
+        else:
+            path = getCachePath()
+        db = sqlite3.connect(os.path.join(path, APP_NAME + '.sqlite'), timeout=30)
+        # WAL needs shared memory, so it can't be used by several computers over a network share
+        db.execute('PRAGMA journal_mode=' + ('DELETE' if shared else 'WAL'))
+        setattr(databaseConnections, name, db)
+    return getattr(databaseConnections, name)
+
+# ==== Local subtitles index ===================================================
+# The index maps a movie hash and size to the subtitles previously found for it.
+# Exported JSON files use the following format (a single entry is also accepted):
+# [ { "moviehash": "8e245d9679d31e12", "moviebytesize": 12909756, "data": [ <search results> ] } ]
+
+def indexOpen():
+    """Open the local index, creating its table if needed"""
+    db = openDatabase(shared=True)
+    db.execute('CREATE TABLE IF NOT EXISTS subtitles_index ('
+               'moviehash TEXT NOT NULL, moviebytesize INTEGER NOT NULL, file_id INTEGER NOT NULL, '
+               'language TEXT, item TEXT NOT NULL, updated REAL, '
+               'PRIMARY KEY (moviehash, moviebytesize, file_id))')
+    return db
+
+def indexStore(moviehash, moviebytesize, subtitlesResultList):
+    """Store the subtitles matched by hash into the local index"""
+    if not subtitlesResultList or 'data' not in subtitlesResultList:
+        return 0
+
+    rows = []
+    for item in subtitlesResultList['data']:
+        if item['attributes'].get('moviehash_match', False) == True:
+            rows.append((moviehash, moviebytesize, item['attributes']['files'][0]['file_id'],
+                         item['attributes']['language'], json.dumps(item), time.time()))
+
+    if rows:
+        db = indexOpen()
+        with db:
+            db.executemany('INSERT OR REPLACE INTO subtitles_index VALUES (?, ?, ?, ?, ?, ?)', rows)
+    return len(rows)
+
+def indexLookupBulk(videoList, languageList):
+    """Lookup a list of (moviehash, moviebytesize) in the local index, using a single query.
+    Return a dict of search results (in API format) indexed by (moviehash, moviebytesize)"""
+    db = indexOpen()
+    db.execute('CREATE TEMP TABLE IF NOT EXISTS index_lookup (moviehash TEXT, moviebytesize INTEGER)')
+    with db:
+        db.execute('DELETE FROM index_lookup')
+        db.executemany('INSERT INTO index_lookup VALUES (?, ?)', videoList)
+
+    results = {}
+    for moviehash, moviebytesize, language, item in db.execute(
+            'SELECT s.moviehash, s.moviebytesize, s.language, s.item FROM subtitles_index s '
+            'JOIN index_lookup l ON s.moviehash = l.moviehash AND s.moviebytesize = l.moviebytesize'):
+        if language in languageList:
+            results.setdefault((moviehash, moviebytesize), {'data': []})['data'].append(json.loads(item))
+
+    # Only keep the videos with subtitles for every requested language
+    for key in list(results):
+        languagesFound = set(item['attributes']['language'] for item in results[key]['data'])
+        if not set(languageList).issubset(languagesFound):
+            del results[key]
+
+    return results
+
+def indexLookup(moviehash, moviebytesize, languageList):
+    """Lookup a single video in the local index"""
+    return indexLookupBulk([(moviehash, moviebytesize)], languageList).get((moviehash, moviebytesize))
+
+def indexImport(jsonPath):
+    """Import an exported JSON file into the local index"""
+    with open(jsonPath, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    if isinstance(entries, dict):
+        entries = [entries]
+
+    count = 0
+    for entry in entries:
+        count += indexStore(entry['moviehash'], int(entry['moviebytesize']), entry)
+    return count
+
+def indexExport(jsonPath):
+    """Export the local index into a JSON file"""
+    entries = {}
+    for moviehash, moviebytesize, item in indexOpen().execute('SELECT moviehash, moviebytesize, item FROM subtitles_index'):
+        entries.setdefault((moviehash, moviebytesize), []).append(json.loads(item))
+
+    with open(jsonPath, 'w', encoding='utf-8') as f:
+        json.dump([{'moviehash': key[0], 'moviebytesize': key[1], 'data': data} for key, data in entries.items()], f)
+    return len(entries)
+
+
+
+# ==== Work sharing ============================================================
+# Several computers can process the same library, using a directory on a shared
+# storage: each video file is claimed (by hash) with an exclusive lockfile, kept
+# alive by a heartbeat. Claims left by a crashed computer expire and are taken over.
+# Lockfiles are used instead of an SQLite queue, as SQLite locking is unreliable
+# over network shares: only the rarely written local index and hash cache are
+# stored in a shared database, the frequently written data (circuit breaker,
+# probe cache, catalog, retry schedule) stays in the local one.
+
+sharedNode = socket.gethostname() + '-' + str(os.getpid())
+sharedLock = threading.Lock()
+sharedClaims = {}
+sharedProcesses = []
+
+def hashCacheOpen():
+    """Open the hash cache, creating its table if needed"""
+    db = openDatabase(shared=True)
+    db.execute('CREATE TABLE IF NOT EXISTS hash_cache ('
+               'path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, moviehash TEXT NOT NULL)')
+    return db
+
+def hashCacheLookup(pathList):
+    """Get the cached hashes of the video files that didn't change since they were hashed"""
+    hashes = {}
+    try:
+        db = hashCacheOpen()
+        for path in pathList:
+            if isURL(path):
+                continue
+            st = os.stat(path)
+            row = db.execute('SELECT moviehash FROM hash_cache WHERE path = ? AND size = ? AND mtime = ?',
+                             (path, st.st_size, st.st_mtime)).fetchone()
+            if row:
+                hashes[path] = row[0]
+        metricsCount('cache_requests', {'cache': 'hash', 'result': 'hit'}, len(hashes))
+        metricsCount('cache_requests', {'cache': 'hash', 'result': 'miss'}, len(pathList) - len(hashes))
+    except (OSError, sqlite3.Error) as err:
+        print("Hash cache error: " + str(err))
+    return hashes
+
+def hashCacheStore(hashes):
+    """Store the hashes of the video files into the hash cache"""
+    try:
+        db = hashCacheOpen()
+        with db:
+            for path, moviehash in hashes.items():
+                if moviehash and moviehash not in ['SizeError', 'IOError'] and not isURL(path):
+                    st = os.stat(path)
+                    db.execute('INSERT OR REPLACE INTO hash_cache VALUES (?, ?, ?, ?)',
+                               (path, st.st_size, st.st_mtime, moviehash))
+    except (OSError, sqlite3.Error) as err:
+        print("Hash cache error: " + str(err))
+
+def sharedClaim(moviehash):
+    """Try to claim a video file (by hash) for this computer, return True if claimed"""
+    claimPath = os.path.join(opt_shared_path, 'claims', moviehash + '.claim')
+    os.makedirs(os.path.dirname(claimPath), exist_ok=True)
+    for _ in range(2):
+        try:
+            fd = os.open(claimPath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(claimPath) < opt_shared_claim_timeout:
+                    return False
+                # Expired claim: take it over (only one computer can win the rename)
+                stalePath = claimPath + '.' + sharedNode
+                os.rename(claimPath, stalePath)
+                if time.time() - os.path.getmtime(stalePath) < opt_shared_claim_timeout:
+                    # Another computer took it over in the meantime, give it back
+                    try:
+                        os.link(stalePath, claimPath)
+                    except OSError:
+                        pass
+                    os.remove(stalePath)
+                    return False
+                os.remove(stalePath)
+            except FileNotFoundError:
+                pass # released in the meantime, try again
+            continue
+        with os.fdopen(fd, 'w') as f:
+            f.write(sharedNode + ' ' + str(time.time()) + '\n')
+        with sharedLock:
+            sharedClaims[moviehash] = claimPath
+        metricsCount('shared_claims', {'result': 'claimed'})
+        return True
+    return False
+
+def sharedClaimVideo(videoPath, videoHash):
+    """Claim a video file before processing it, return False if it should be skipped"""
+    if not videoHash or videoHash in ['SizeError', 'IOError']:
+        return True
+    try:
+        if not sharedClaim(videoHash):
+            metricsCount('files_skipped', {'reason': 'claimed_elsewhere'})
+            return False
+    except OSError as err:
+        print("Work sharing error: " + str(err))
+        return False
+    # Another computer may have processed it since we scanned it
+    if not opt_search_overwrite and checkSubtitlesExists(videoPath):
+        sharedRelease(videoHash)
+        metricsCount('files_skipped', {'reason': 'subtitles_exist'})
+        return False
+    return True
+
+def sharedRelease(moviehash):
+    """Release a claim held by this computer"""
+    with sharedLock:
+        claimPath = sharedClaims.pop(moviehash, None)
+    if claimPath:
+        try:
+            os.remove(claimPath)
+        except OSError:
+            pass
+
+def sharedReleaseFinished():
+    """Release the claims of the dispatched instances that exited"""
+    with sharedLock:
+        finished = [entry for entry in sharedProcesses if entry[0].poll() is not None]
+        sharedProcesses[:] = [entry for entry in sharedProcesses if entry not in finished]
+    for _, moviehash in finished:
+        sharedRelease(moviehash)
+
+def sharedHeartbeat():
+    """Keep the claims of this computer alive, and release them once processed"""
+    lastBeat = time.monotonic()
+    while True:
+        time.sleep(1)
+        sharedReleaseFinished()
+        if time.monotonic() - lastBeat >= opt_shared_heartbeat:
+            lastBeat = time.monotonic()
+            with sharedLock:
+                claimPaths = list(sharedClaims.values())
+            for claimPath in claimPaths:
+                try:
+                    os.utime(claimPath)
+                except OSError as err:
+                    print("Work sharing error: " + str(err))
+
+def sharedFinish():
+    """At exit: wait for the dispatched instances, then release every claim"""
+    while sharedProcesses:
+        sharedReleaseFinished()
+        time.sleep(1)
+    for moviehash in list(sharedClaims):
+        sharedRelease(moviehash)
+
+# ==== Incremental catalog =====================================================
+# The catalog stores the modification time of every scanned folder, and the status
+# of every video file found ('pending', 'subtitles' or 'no_subtitles'). Folders
+# that didn't change are not listed again (only their pending video files are).
+# Note that a video file overwritten in place doesn't change its folder mtime, so
+# it will only be processed again once something else changes in its folder.
+
+def catalogOpen():
+    """Open the catalog, creating its tables if needed"""
+    db = openDatabase()
+    db.execute('CREATE TABLE IF NOT EXISTS catalog_dirs ('
+               'path TEXT PRIMARY KEY, mtime REAL NOT NULL, subdirs TEXT NOT NULL)')
+    db.execute('CREATE TABLE IF NOT EXISTS catalog_files ('
+               'path TEXT PRIMARY KEY, dir TEXT NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL, '
+               'status TEXT NOT NULL, attempted REAL)')
+    db.execute('CREATE INDEX IF NOT EXISTS catalog_files_dir ON catalog_files (dir)')
+    return db
+
+def catalogWalk(rootPath, recursive):
+    """Walk a folder, only listing the folders that changed since the previous scan.
+    Yield the files that are new, modified, or still pending"""
+    db = catalogOpen()
+    # Videos without subtitles are filtered later on by the retry schedule, or all searched again with '--force'
+    revisit = ('pending', 'no_subtitles') if (opt_retry_schedule and opt_gui == 'cli') or arguments.force else ('pending',)
+    folders = [rootPath]
+    while folders:
+        path = folders.pop()
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+
+        row = db.execute('SELECT mtime, subdirs FROM catalog_dirs WHERE path = ?', (path,)).fetchone()
+        if row and row[0] == mtime:
+            metricsCount('catalog_dirs', {'result': 'unchanged'})
+            subdirs = json.loads(row[1])
+            pending = db.execute('SELECT path FROM catalog_files WHERE dir = ? AND status IN (%s)' % ','.join('?' * len(revisit)),
+                                 (path,) + revisit).fetchall()
+            for (filePath,) in pending:
+                yield filePath
+        else:
+            metricsCount('catalog_dirs', {'result': 'changed'})
+            subdirs = []
+            files = []
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        else:
+                            files.append(entry)
+            except OSError:
+                continue
+
+            known = dict((row[0], row[1:]) for row in db.execute(
+                'SELECT path, size, mtime, status FROM catalog_files WHERE dir = ?', (path,)))
+            for entry in files:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entryKnown = known.pop(entry.path, None)
+                if entryKnown and entryKnown[0] == st.st_size and entryKnown[1] == st.st_mtime and entryKnown[2] not in revisit:
+                    continue
+                yield entry.path
+
+            # Forget the files and folders that disappeared
+            db.executemany('DELETE FROM catalog_files WHERE path = ?', [(filePath,) for filePath in known])
+            if row:
+                db.executemany('DELETE FROM catalog_dirs WHERE path = ?',
+                               [(os.path.join(path, name),) for name in json.loads(row[1]) if name not in subdirs])
+
+            # A folder modified during the last seconds may still change without its mtime changing
+            if time.time() - mtime < 2:
+                mtime = 0
+            db.execute('INSERT OR REPLACE INTO catalog_dirs VALUES (?, ?, ?)', (path, mtime, json.dumps(subdirs)))
+            db.commit()
+
+        if recursive:
+            folders.extend(os.path.join(path, name) for name in reversed(subdirs))
+
+def catalogUpdate(path, status, attempt=False):
+    """Set the status of a video file. Statuses set while scanning are committed by
+    catalogWalk(), statuses resulting from an attempt are committed right away"""
+    if isURL(path):
+        return
+    db = catalogOpen()
+    st = os.stat(path)
+    db.execute('INSERT OR REPLACE INTO catalog_files VALUES (?, ?, ?, ?, ?, '
+               'COALESCE(?, (SELECT attempted FROM catalog_files WHERE path = ?)))',
+               (path, os.path.dirname(path), st.st_size, st.st_mtime, status, time.time() if attempt else None, path))
+    if attempt:
+        db.commit()
+
+# ==== Retry schedule ==========================================================
+# Every unsuccessful search of a video (by hash) in a language delays its next
+# search in this language, following 'opt_retry_schedule'. A video is skipped
+# while all of the requested languages are delayed.
+
+def retryEnabled():
+    """Check if the retry schedule should be honored by this run
+    (instances dispatched with a hash have already been checked by the dispatcher)"""
+    return bool(opt_retry_schedule) and opt_gui == 'cli' and not arguments.force and not arguments.moviehash
+
+def retryOpen():
+    """Open the retry schedule, creating its table if needed"""
+    db = openDatabase()
+    db.execute('CREATE TABLE IF NOT EXISTS retry_schedule ('
+               'moviehash TEXT NOT NULL, language TEXT NOT NULL, attempts INTEGER NOT NULL, next_attempt REAL NOT NULL, '
+               'PRIMARY KEY (moviehash, language))')
+    return db
+
+def retryDue(moviehash, languageList):
+    """Check if a video should be searched, in at least one of the languages"""
+    if not moviehash or moviehash in ['SizeError', 'IOError']:
+        return True
+    db = retryOpen()
+    now = time.time()
+    for language in languageList:
+        row = db.execute('SELECT next_attempt FROM retry_schedule WHERE moviehash = ? AND language = ?',
+                         (moviehash, language.lower())).fetchone()
+        if not row or row[0] <= now:
+            return True
+    return False
+
+def retryUpdate(moviehash, languageList, subtitlesList):
+    """Forget the languages with subtitles, and delay the next search of the others"""
+    if not moviehash or moviehash in ['SizeError', 'IOError']:
+        return
+    languagesFound = set(sub.language.lower() for sub in subtitlesList)
+    db = retryOpen()
+    with db:
+        for language in [language.lower() for language in languageList]:
+            if language in languagesFound:
+                db.execute('DELETE FROM retry_schedule WHERE moviehash = ? AND language = ?', (moviehash, language))
+                continue
+            row = db.execute('SELECT attempts FROM retry_schedule WHERE moviehash = ? AND language = ?',
+                             (moviehash, language)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            delay = opt_retry_schedule[min(attempts, len(opt_retry_schedule)) - 1]
+            db.execute('INSERT OR REPLACE INTO retry_schedule VALUES (?, ?, ?, ?)',
+                       (moviehash, language, attempts, time.time() + delay))
 
 # ==============================================================================
 # ==== Main program (execution starts here) ====================================
@@ -743,9 +2798,32 @@ parser.add_argument('-o', '--output', help="Override subtitles download path, in
 parser.add_argument('-x', '--suffix', help="Force language code file suffix", action='store_true')
 parser.add_argument('--noai', help="Ignore AI or machine translated subtitles", action='store_true')
 parser.add_argument('--nohi', help="Ignore HI (hearing impaired) subtitles", action='store_true')
-parser.add_argument('searchPathList', help="The video file(s) or folder(s) for which subtitles should be searched and downloaded", nargs='+')
+parser.add_argument('--hash-threads', help="Set the number of concurrent reads per storage device while hashing (default: 1)", type=int)
+parser.add_argument('--moviehash', help=argparse.SUPPRESS) # hash already computed by the dispatcher
+parser.add_argument('--timeout', help="Set network connect and read timeouts, in seconds (default: 10 and 30)", type=float)
+parser.add_argument('--deadline', help="Set the maximum time spent on a single video file, in seconds (default: 300, 0 to disable)", type=float)
+parser.add_argument('--retries', help="Set the number of retries for requests failing with a transient error (default: 3)", type=int)
+parser.add_argument('--hedge', help="Send a duplicate search request after this delay, in seconds (default: 0, disabled)", type=float)
+parser.add_argument('--prefetch', help="Resolve and fetch the N best subtitles while the selection window is open (default: 0)\nWARNING: every resolved subtitles counts against your download quota", type=int)
+parser.add_argument('--metrics', help="Write metrics about the run into this file (Prometheus text format, for node_exporter)")
+parser.add_argument('--metrics-spool', help=argparse.SUPPRESS) # metrics of dispatched instances
+parser.add_argument('--profile', help="Profile CPU and memory usage, and write the results into this directory")
+parser.add_argument('--plan', help="Search and automatically select subtitles for all videos, and write them into a JSON plan file")
+parser.add_argument('--apply', help="Download the subtitles listed in a JSON plan file")
+parser.add_argument('--index', help="Consult (and populate) the local subtitles index before searching online", action='store_true')
+parser.add_argument('--index-import', help="Import an exported JSON file into the local subtitles index")
+parser.add_argument('--index-export', help="Export the local subtitles index into a JSON file")
+parser.add_argument('--cache', help="Override the directory used to store the local index and other persistent data")
+parser.add_argument('--force', help="Search every video, even the ones recently searched without success", action='store_true')
+parser.add_argument('--catalog', help="Only scan the folders and process the video files that changed since the previous run", action='store_true')
+parser.add_argument('--shared', help="Share the work with other computers, using this directory on a shared storage")
+parser.add_argument('--claimed', help=argparse.SUPPRESS, action='store_true') # claim already held by the dispatcher
+parser.add_argument('searchPathList', help="The video file(s) or folder(s) for which subtitles should be searched and downloaded", nargs='*')
 arguments = parser.parse_args()
 
+if not arguments.searchPathList and not arguments.index_import and not arguments.index_export and not arguments.apply:
+    parser.error("the following arguments are required: searchPathList")
+
 # Handle arguments
 if arguments.cli:
     opt_gui = 'cli'
@@ -772,6 +2850,61 @@ if arguments.noai:
     opt_ignore_ai_translated = True
 if arguments.nohi:
     opt_ignore_hi = True
+if arguments.hash_threads is not None:
+    opt_hash_threads_per_device = arguments.hash_threads
+if arguments.timeout is not None:
+    opt_timeout_connect = arguments.timeout
+    opt_timeout_read = arguments.timeout
+if arguments.deadline is not None:
+    opt_file_deadline = arguments.deadline
+if arguments.retries is not None:
+    opt_retries = max(0, arguments.retries)
+if arguments.hedge is not None:
+    opt_hedge_delay = arguments.hedge
+if arguments.prefetch is not None:
+    opt_prefetch_count = max(0, arguments.prefetch)
+if arguments.metrics:
+    opt_metrics_path = os.path.abspath(arguments.metrics)
+if arguments.plan or arguments.apply:
+    opt_gui = 'cli'
+    opt_selection_mode = 'auto'
+if arguments.index:
+    opt_local_index = True
+if arguments.cache:
+    opt_cache_path = arguments.cache
+if arguments.catalog:
+    opt_catalog = True
+if arguments.shared:
+    opt_shared_path = arguments.shared
+if opt_shared_path:
+    opt_shared_path = os.path.abspath(os.path.expanduser(opt_shared_path))
+    opt_local_index = True
+
+# ==== Profiling
+
+if arguments.profile:
+    profileStart(os.path.abspath(arguments.profile))
+
+# ==== Metrics
+
+if opt_metrics_path and not arguments.metrics_spool:
+    metricsSpoolPath = tempfile.mkdtemp(prefix=APP_NAME + '-metrics-')
+if opt_metrics_path or arguments.metrics_spool:
+    atexit.register(metricsFinish)
+
+# ==== Local index maintenance
+
+if arguments.index_import or arguments.index_export:
+    try:
+        if arguments.index_import:
+            print(">> " + str(indexImport(arguments.index_import)) + " subtitles imported into the local index")
+        if arguments.index_export:
+            print(">> " + str(indexExport(arguments.index_export)) + " videos exported from the local index")
+    except (OSError, ValueError, KeyError, TypeError, sqlite3.Error) as err:
+        print("Local index error: " + str(err))
+        sys.exit(2)
+    if not arguments.searchPathList:
+        sys.exit(0)
 
 # GUI auto detection
 if opt_gui == 'auto':
@@ -813,6 +2946,15 @@ if not osd_username or not osd_password:
     superPrint("warning", "OpenSubtitles.com account required!", "A valid account from OpenSubtitles.com is <b>REQUIRED</b>, please register on the website!")
     sys.exit(2)
 
+# ==== Apply a plan
+
+if arguments.apply:
+    try:
+        sys.exit(applyPlan(os.path.abspath(arguments.apply)))
+    except (OSError, ValueError, KeyError) as err:
+        print("Plan error: " + str(err))
+        sys.exit(2)
+
 # ==== Count languages selected for this search
 
 if isinstance(opt_languages, list):
@@ -824,30 +2966,92 @@ languageCount_search = len(languageList)
 
 # ==== Get video paths, validate them, and if needed check if subtitles already exists
 
+def scanVideoPath(path):
+    """Add a video file to the list, unless it's invalid or already has subtitles (and these should be skipped)"""
+    metricsCountScan('files_scanned')
+    if checkFileValidity(path):
+        if opt_search_overwrite or (not opt_search_overwrite and not checkSubtitlesExists(path)):
+            videoPathList.append(path)
+            if opt_catalog:
+                catalogUpdate(path, 'pending')
+        else:
+            metricsCountScan('files_skipped', {'reason': 'subtitles_exist'})
+            if opt_catalog:
+                catalogUpdate(path, 'subtitles')
+
 for i in arguments.searchPathList:
+    if isURL(i): # if it's a file served over http(s)
+        scanVideoPath(i)
+        continue
     path = os.path.abspath(i)
     if os.path.isdir(path): # if it's a folder
-        if opt_gui == 'cli': # check all of the folder's (recursively)
+        if opt_catalog: # only check the new or modified files (recursively in CLI mode)
+            try:
+                for item in catalogWalk(path, opt_gui == 'cli'):
+                    scanVideoPath(item)
+            except (OSError, sqlite3.Error) as err:
+                print("Catalog error: " + str(err))
+                sys.exit(2)
+        elif opt_gui == 'cli': # check all of the folder's (recursively)
             for root, _, items in os.walk(path):
                 for item in items:
-                    localPath = os.path.join(root, item)
-                    if checkFileValidity(localPath):
-                        if opt_search_overwrite or (not opt_search_overwrite and not checkSubtitlesExists(localPath)):
-                            videoPathList.append(localPath)
+                    scanVideoPath(os.path.join(root, item))
         else: # check all of the folder's files
             for item in os.listdir(path):
-                localPath = os.path.join(path, item)
-                if checkFileValidity(localPath):
-                    if opt_search_overwrite or (not opt_search_overwrite and not checkSubtitlesExists(localPath)):
-                        videoPathList.append(localPath)
-    elif checkFileValidity(path): # if it is a file
-        if opt_search_overwrite or (not opt_search_overwrite and not checkSubtitlesExists(path)):
-            videoPathList.append(path)
+                scanVideoPath(os.path.join(path, item))
+    else: # if it is a file
+        scanVideoPath(path)
+
+if opt_catalog:
+    openDatabase().commit()
 
 # If videoPathList is empty, abort!
 if not videoPathList:
     sys.exit(1)
 
+# ==== Hash all the video files at once, minimizing seeks ======================
+
+videoHashList = {}
+if len(videoPathList) > 1 or arguments.plan or (opt_shared_path and not arguments.claimed) or retryEnabled():
+    videoHashList = hashFiles(videoPathList)
+
+# ==== Retry schedule: skip the videos recently searched without success
+
+if retryEnabled():
+    retrySkipped = len(videoPathList)
+    try:
+        videoPathList = [path for path in videoPathList if retryDue(videoHashList.get(path), languageList)]
+    except sqlite3.Error as err:
+        print("Retry schedule error: " + str(err))
+
+    retrySkipped -= len(videoPathList)
+    if retrySkipped > 0:
+        metricsCount('files_skipped', {'reason': 'retry_scheduled'}, retrySkipped)
+        print(">> " + str(retrySkipped) + " video(s) recently searched without success, skipped until their next retry (use '--force' to search them anyway)")
+    if not videoPathList:
+        sys.exit(1)
+
+# ==== Plan: search and select subtitles for every video, without downloading them
+
+if arguments.plan:
+    try:
+        sys.exit(writePlan(os.path.abspath(arguments.plan), videoPathList, videoHashList))
+    except OSError as err:
+        print("Plan error: " + str(err))
+        sys.exit(2)
+
+# ==== Work sharing: claim the video files before processing them
+
+if opt_shared_path and not arguments.claimed:
+    atexit.register(sharedFinish)
+    threading.Thread(target=sharedHeartbeat, daemon=True).start()
+
+    # Skip the video files already claimed by other computers
+    while videoPathList and not sharedClaimVideo(videoPathList[0], videoHashList.get(videoPathList[0])):
+        videoPathList.pop(0)
+    if not videoPathList:
+        sys.exit(1)
+
 # ==== Instances dispatcher ====================================================
 
 # The first video file will be processed by this instance
@@ -857,6 +3061,9 @@ videoPathList.pop(0)
 # The remaining file(s) are dispatched to new instance(s) of this script
 for videoPathDispatch in videoPathList:
 
+    if opt_shared_path and not sharedClaimVideo(videoPathDispatch, videoHashList.get(videoPathDispatch)):
+        continue
+
     # Pass settings
     command = [ sys.executable, scriptPath,
                 "-g", opt_gui, "-s", opt_search_mode, "-t", opt_selection_mode, "-l", opt_languages ]
@@ -871,24 +3078,72 @@ for videoPathDispatch in videoPathList:
         command.append("-o")
         command.append(opt_output_path)
 
+    command += ["--deadline", str(opt_file_deadline), "--retries", str(opt_retries), "--hedge", str(opt_hedge_delay)]
+
+    if opt_timeout_connect == opt_timeout_read:
+        command += ["--timeout", str(opt_timeout_read)]
+
+    if opt_prefetch_count > 0:
+        command += ["--prefetch", str(opt_prefetch_count)]
+
+    if opt_local_index:
+        command.append("--index")
+
+    if opt_cache_path:
+        command.append("--cache")
+        command.append(opt_cache_path)
+
     if arguments.username and arguments.password:
         command.append("-u")
         command.append(arguments.username)
         command.append("-p")
         command.append(arguments.password)
 
+    if videoHashList.get(videoPathDispatch):
+        command += ["--moviehash", videoHashList[videoPathDispatch]]
+
+    if metricsSpoolPath:
+        command += ["--metrics-spool", metricsSpoolPath]
+
+    if arguments.profile:
+        command += ["--profile", os.path.abspath(arguments.profile)]
+
+    if opt_catalog:
+        command.append("--catalog")
+
+    if arguments.force:
+        command.append("--force")
+
+    if opt_shared_path:
+        command += ["--shared", opt_shared_path, "--claimed"]
+
     # Pass video file
     command.append(videoPathDispatch)
 
     # Do not spawn too many instances at once, avoid error '429 Too Many Requests'
     time.sleep(2)
 
+    # Pause the batch while the API is down
+    try:
+        breakerWait(probe=False)
+    except ConnectionError:
+        superPrint("error", "OpenSubtitles.com unreachable!", "The OpenSubtitles.com API is still unreachable, giving up...")
+        sys.exit(2)
+
     if opt_gui == 'cli' and opt_selection_mode != 'auto':
         # Synchronous call
         process_videoDispatched = subprocess.call(command)
+        if opt_shared_path:
+            sharedRelease(videoHashList.get(videoPathDispatch))
     else:
         # Asynchronous call
         process_videoDispatched = subprocess.Popen(command)
+        dispatchedProcesses.append(process_videoDispatched)
+        if opt_shared_path:
+            with sharedLock:
+                sharedProcesses.append((process_videoDispatched, videoHashList.get(videoPathDispatch)))
+
+    metricsRefresh()
 
 # ==== Search and download subtitles ===========================================
 
@@ -897,32 +3152,34 @@ try:
     subtitlesResultList = []
     languageCount_results = 0
 
+    ## Start the clock for this file
+    if opt_file_deadline > 0:
+        fileDeadline = time.monotonic() + opt_file_deadline
+
     ## Get file hash, size and name
     videoTitle = u''
-    videoHash = hashFile(currentVideoPath)
-    videoSize = os.path.getsize(currentVideoPath)
-    videoFileName = os.path.basename(currentVideoPath)
+    videoHash = videoHashList.get(currentVideoPath) or arguments.moviehash or hashFile(currentVideoPath)
+    (videoSize, videoFileName) = getVideoInfo(currentVideoPath)
 
     ## Search for subtitles
     try:
-        if (opt_search_mode == 'hash_and_filename'):
-            subtitlesResultList = searchSubtitles(moviehash=videoHash, query=videoFileName, languages=opt_languages)
-            #print(f"SEARCH BY HASH AND NAME >>>>> length {len(subtitlesResultList['data'])} >>>>> {subtitlesResultList['data']}")
-        else:
-            if any(mode in opt_search_mode for mode in ['hash_then_filename', 'hash']):
-                subtitlesResultList = searchSubtitles(moviehash=videoHash, languages=opt_languages)
-                #print(f"SEARCH BY HASH >>>>> length {len(subtitlesResultList['data'])} >>>>> {subtitlesResultList['data']}")
-            if ((opt_search_mode == 'filename') or
-                (opt_search_mode == 'hash_then_filename' and len(subtitlesResultList['data']) == 0)):
-                subtitlesResultList = searchSubtitles(query=videoFileName, languages=opt_languages)
-                #print(f"SEARCH BY NAME >>>>> length {len(subtitlesResultList['data'])} >>>>> {subtitlesResultList['data']}")
-
+        subtitlesResultList = searchVideo(videoHash, videoSize, videoFileName)
     except Exception:
+        metricsCount('files_failed', {'reason': 'search_error'})
         superPrint("error", "Search error!", "Unable to reach opensubtitles.com servers!\n<b>Search error</b>")
         sys.exit(2)
 
-    ## Parse the results of the search query
-    if subtitlesResultList and 'data' in subtitlesResultList and len(subtitlesResultList['data']) > 0:
+    ## Parse the results of the search query (and apply the ignore filters)
+    subtitlesList = parseSearchResults(subtitlesResultList)
+
+    ## Delay the next search of the languages without subtitles
+    if opt_retry_schedule:
+        try:
+            retryUpdate(videoHash, languageList, subtitlesList)
+        except sqlite3.Error as err:
+            print("Retry schedule error: " + str(err))
+
+    if len(subtitlesList) > 0:
         # Mark search as successful
         languageCount_results += 1
 
@@ -930,14 +3187,14 @@ try:
         subIndex = 0
 
         # If there is only one subtitles (matched by file hash), auto-select it (except in CLI mode)
-        if (len(subtitlesResultList['data']) == 1) and (subtitlesResultList['data'][0]['attributes'].get('moviehash_match', False) == True):
+        if (len(subtitlesList) == 1) and subtitlesList[0].moviehash_match:
             if opt_selection_mode != 'manual':
-                subName = subtitlesResultList['data'][0]['attributes']['files'][0]['file_id']
+                subName = subtitlesList[0].file_id
 
         # Check if we have a valid title, found by hash
-        for item in subtitlesResultList['data']:
-            if item['attributes'].get('moviehash_match', False) == True:
-                videoTitle = item['attributes']['feature_details']['movie_name']
+        for sub in subtitlesList:
+            if sub.moviehash_match:
+                videoTitle = sub.movie_name
                 break
 
         # Title and filename may need string sanitizing to avoid zenity/kdialog handling errors
@@ -949,90 +3206,101 @@ try:
         if not subName:
             if opt_selection_mode == 'auto':
                 # Automatic subtitles selection
-                (subName, subIndex) = selectionAuto(subtitlesResultList, languageList)
+                (subName, subIndex) = selectionAuto(subtitlesList, languageList)
             else:
                 # Go through the list of subtitles and handle 'auto' settings activation
-                for item in subtitlesResultList['data']:
+                for sub in subtitlesList:
                     if opt_selection_match == 'auto':
                         if (opt_search_mode == 'hash_and_filename' or opt_search_mode == 'hash_then_filename'):
-                            if item['attributes'].get('moviehash_match', False) == False:
+                            if not sub.moviehash_match:
                                 opt_selection_match = 'on'
                     if opt_selection_language == 'auto' and languageCount_search > 1:
                         opt_selection_language = 'on'
-                    if opt_selection_hi == 'auto' and item['attributes'].get('hearing_impaired', False) == True:
+                    if opt_selection_hi == 'auto' and sub.hearing_impaired:
                         opt_selection_hi = 'on'
-                    if opt_selection_rating == 'auto' and item['attributes']['ratings'] != '0.0':
+                    if opt_selection_rating == 'auto' and str(sub.ratings) != '0.0':
                         opt_selection_rating = 'on'
                     if opt_selection_count == 'auto':
                         opt_selection_count = 'on'
-                    if opt_selection_fps == 'auto' and item['attributes'].get('fps', '0.0') != '0.0':
+                    if opt_selection_fps == 'auto' and str(sub.fps) != '0.0':
                         opt_selection_fps = 'on'
 
+                # Log in and prefetch the best candidates while the user is choosing
+                prefetchStart(subtitlesList, languageList)
+
                 # Spaw selection window
                 if opt_gui == 'gnome':
-                    (subName, subIndex) = selectionGnome(subtitlesResultList)
+                    (subName, subIndex) = selectionGnome(subtitlesList)
                 elif opt_gui == 'kde':
-                    (subName, subIndex) = selectionKDE(subtitlesResultList)
+                    (subName, subIndex) = selectionKDE(subtitlesList)
                 else: # CLI
-                    (subName, subIndex) = selectionCLI(subtitlesResultList)
+                    (subName, subIndex) = selectionCLI(subtitlesList)
+
+                # Restart the clock, the time spent by the user choosing doesn't count
+                if opt_file_deadline > 0:
+                    fileDeadline = time.monotonic() + opt_file_deadline
 
         ## At this point a subtitles should be selected
         if subName:
-            # Log-in to the API
-            USER_TOKEN = getUserToken(username=osd_username, password=osd_password)
-
-            # Prepare download
-            fileId = subtitlesResultList['data'][int(subIndex)]['attributes']['files'][0]['file_id']
-            fileInfo = getSubtitlesInfo(USER_TOKEN, fileId)
-
-            # Quote the URL to avoid characters like brackets () causing errors in wget command below
-            subURL = f"\'{fileInfo['link']}\'"
-            subSuffix = subURL.split('.')[-1].strip("'")
-            subLangName = subtitlesResultList['data'][int(subIndex)]['attributes']['language']
-            subPath = u''
-
-            if opt_output_path and os.path.isdir(os.path.abspath(opt_output_path)):
-                # Use the output path provided by the user
-                subPath = os.path.abspath(opt_output_path) + "/" + currentVideoPath.rsplit('.', 1)[0].rsplit('/', 1)[1] + '.' + subSuffix
-            else:
-                # Use the path of the input video, and the suffix of the subtitles file
-                subPath = currentVideoPath.rsplit('.', 1)[0] + '.' + subSuffix
+            # Log-in to the API (unless already done in the background)
+            prefetch = prefetchFinish()
+            USER_TOKEN = prefetch['token'] or getUserToken(username=osd_username, password=osd_password)
 
-            # Write language code into the filename?
-            if opt_language_suffix == 'on':
-                subPath = subPath.rsplit('.', 1)[0] + opt_language_suffix_separator + subtitlesResultList['data'][int(subIndex)]['attributes']['language'] + '.' + subSuffix
+            # Prepare download (unless already done in the background)
+            subSelected = subtitlesList[int(subIndex)]
+            fileInfo = prefetch['links'].get(subSelected.file_id) or getSubtitlesInfo(USER_TOKEN, subSelected.file_id)
+            subContent = prefetch['contents'].get(subSelected.file_id)
 
-            # Escape non-alphanumeric characters from the subtitles download path
-            subPath = escapePath(subPath)
+            subURL = fileInfo['link']
+            subSuffix = subURL.split('.')[-1]
+            subLangName = subSelected.language
+            subPath = getSubtitlesPath(currentVideoPath, subSelected.language, subSuffix)
 
             # Empty videoTitle?
             if not videoTitle:
                 videoTitle = videoFileName
 
             ## Download and unzip the selected subtitles
-            if opt_gui == 'gnome':
-                process_subtitlesDownload = subprocess.call("(wget -q -O \"" + subPath + "\" " + subURL + ") 2>&1"
-                                                            + ' | (zenity --auto-close --progress --pulsate --title="Downloading subtitles, please wait..." --text="Downloading <b>'
-                                                            + subLangName + '</b> subtitles for <b>' + videoTitle + '</b>...")', shell=True)
+            wgetCommand = ['wget', '-q', '--connect-timeout=' + str(opt_timeout_connect), '--read-timeout=' + str(opt_timeout_read),
+                           '--tries=' + str(opt_retries + 1), '-O', subPath, subURL]
+            if subContent:
+                # Already fetched in the background, just write it
+                process_subtitlesDownload = downloadSubtitles(USER_TOKEN, fileInfo['link'], subPath, subContent)
+            elif opt_gui == 'gnome':
+                process_wget = subprocess.Popen(wgetCommand, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                subprocess.call(['zenity', '--auto-close', '--progress', '--pulsate', '--title=Downloading subtitles, please wait...',
+                                 '--text=Downloading <b>' + subLangName + '</b> subtitles for <b>' + videoTitle + '</b>...'], stdin=process_wget.stdout)
+                process_wget.stdout.close()
+                process_subtitlesDownload = process_wget.wait()
             elif opt_gui == 'kde':
-                process_subtitlesDownload = subprocess.call("(wget -q -O \"" + subPath + "\" " + subURL + ") 2>&1", shell=True)
+                process_subtitlesDownload = subprocess.call(wgetCommand, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
             else: # CLI
-                print(">> Downloading '" + subtitlesResultList['data'][subIndex]['attributes']['language'] + "' subtitles for '" + videoTitle + "'")
+                print(">> Downloading '" + subSelected.language + "' subtitles for '" + videoTitle + "'")
                 process_subtitlesDownload = downloadSubtitles(USER_TOKEN, fileInfo['link'], subPath)
 
             # If an error occurs, say so
             if process_subtitlesDownload != 0:
+                metricsCount('files_failed', {'reason': 'download_error'})
                 superPrint("error", "Subtitling error!",
-                           "An error occurred while downloading or writing '<b>" + subtitlesResultList['data'][subIndex]['attributes']['language'] + "</b>' " +
+                           "An error occurred while downloading or writing '<b>" + subSelected.language + "</b>' " +
                            "subtitles for <b>" + videoTitle + "</b>.")
                 sys.exit(2)
 
+            metricsCount('files_downloaded')
+            if opt_catalog:
+                catalogUpdate(currentVideoPath, 'subtitles', attempt=True)
+        else:
+            metricsCount('files_skipped', {'reason': 'cancelled'})
+
         ## HOOK # Use a secondary tool after a successful download?
         #process_subtitlesDownload = subprocess.call("(custom_command" + " " + subPath + ") 2>&1", shell=True)
 
     ## Print a message if no subtitles have been found, for any of the languages
     if languageCount_results == 0:
+        metricsCount('files_failed', {'reason': 'no_subtitles'})
         superPrint("info", "No subtitles available :-(", '<b>No subtitles found</b> for this video:\n<i>' + videoFileName + '</i>')
+        if opt_catalog:
+            catalogUpdate(currentVideoPath, 'no_subtitles', attempt=True)
         ExitCode = 1
     else:
         ExitCode = 0
@@ -1041,9 +3309,11 @@ except KeyboardInterrupt:
     sys.exit(1)
 
 except urllib.error.HTTPError as e:
+    metricsCount('files_failed', {'reason': 'network_error'})
     superPrint("error", "Network error", "Network error: " + e.reason)
 
 except (OSError, IOError, RuntimeError, AttributeError, TypeError, NameError, KeyError):
+    metricsCount('files_failed', {'reason': 'unexpected_error'})
     # An unknown error occur, let's apologize before exiting
     superPrint("error", "Unexpected error!",
                "OpenSubtitlesDownload encountered an <b>unknown error</b>, sorry about that...\n\n" + \